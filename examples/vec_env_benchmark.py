@@ -0,0 +1,54 @@
+# Compare the shared-memory and pickling paths of SubprocVecEnv.
+#   $ python examples/vec_env_benchmark.py --num_envs 16 --seconds 10
+
+import argparse
+import time
+import gym
+import numpy as np
+
+import marlgrid.envs
+from marlgrid.vector.subproc import SubprocVecEnv
+
+
+def make_env(env_name, env_ix):
+    env = gym.envs.registration.load(gym.spec(env_name).entry_point)()
+    env.seed(env_ix)
+    return env
+
+
+class EnvFn:
+    def __init__(self, env_name):
+        self.env_name = env_name
+
+    def __call__(self, env_ix):
+        return make_env(self.env_name, env_ix)
+
+
+def benchmark(env_name, num_envs, num_workers, shared_memory, seconds):
+    venv = SubprocVecEnv(EnvFn(env_name), num_envs, num_workers=num_workers, shared_memory=shared_memory)
+    rng = np.random.default_rng(0)
+    try:
+        venv.reset()
+        n_steps = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            actions = rng.integers(0, 3, size=(num_envs, venv.num_agents))
+            venv.step(actions)
+            n_steps += 1
+        elapsed = time.perf_counter() - t0
+    finally:
+        venv.close()
+    return n_steps * num_envs / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', default='MarlGrid-3AgentCluttered15x15-v0')
+    parser.add_argument('--num_envs', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for shared_memory in (False, True):
+        sps = benchmark(args.env, args.num_envs, args.num_workers, shared_memory, args.seconds)
+        print(f"{args.env} | num_envs={args.num_envs} shared_memory={shared_memory}: {sps:.0f} env steps/sec")
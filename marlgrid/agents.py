@@ -55,15 +55,41 @@ class GridAgentInterface(GridAgent):
             # warnings.warn("prestige_beta must be between 0 and 1. Using default 0.99")
             self.prestige_beta = 0.95
             
+        self._make_spaces()
+
+        self.metadata = {
+            **self.metadata,
+            'view_size': view_size,
+            'view_tile_size': view_tile_size,
+        }
+        self.reset(new_episode=True)
+
+    def _make_spaces(self):
         image_space = gym.spaces.Box(
             low=0,
             high=255,
-            shape=(view_tile_size * view_size, view_tile_size * view_size, 3),
+            shape=(self.view_tile_size * self.view_size, self.view_tile_size * self.view_size, 3),
             dtype="uint8",
         )
-        if observation_style == 'image':
+        if self.observation_style == 'image':
             self.observation_space = image_space
-        elif observation_style == 'rich':
+        elif self.observation_style == 'palette':
+            # One index into MultiGrid.palette per pixel; see marlgrid.palette.
+            self.observation_space = gym.spaces.Box(
+                low=0,
+                high=255,
+                shape=(self.view_tile_size * self.view_size, self.view_tile_size * self.view_size),
+                dtype="uint8",
+            )
+        elif self.observation_style == 'symbolic':
+            # Egocentric (type, color, state) encoding of the view; see MultiGridEnv.gen_symbolic_obs.
+            self.observation_space = gym.spaces.Box(
+                low=0,
+                high=255,
+                shape=(self.view_size, self.view_size, 3),
+                dtype="uint8",
+            )
+        elif self.observation_style == 'rich':
             obs_space = {
                 'pov': image_space,
             }
@@ -75,49 +101,59 @@ class GridAgentInterface(GridAgent):
                 obs_space['orientation'] = gym.spaces.Discrete(n=4)
             self.observation_space = gym.spaces.Dict(obs_space)
         else:
-            raise ValueError(f"{self.__class__.__name__} kwarg 'observation_style' must be one of 'image', 'rich'.")
+            raise ValueError(f"{self.__class__.__name__} kwarg 'observation_style' must be one of 'image', 'rich', 'palette', 'symbolic'.")
 
         if self.restrict_actions:
             self.action_space = gym.spaces.Discrete(3)
         else:
             self.action_space = gym.spaces.Discrete(len(self.actions))
 
-        self.metadata = {
-            **self.metadata,
-            'view_size': view_size,
-            'view_tile_size': view_tile_size,
-        }
-        self.reset(new_episode=True)
+    def __getstate__(self):
+        # The spaces only depend on the agent's settings, and image Boxes hold two full-size
+        #  arrays each, so they're rebuilt by _make_spaces rather than pickled.
+        state = dict(self.__dict__)
+        state.pop('observation_space', None)
+        state.pop('action_space', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_spaces()
 
     def render_post(self, tile):
         if not self.active:
             return tile
 
-        blue = np.array([0,0,255])
-        red = np.array([255,0,0])
-
         if self.color == 'prestige':
-            # Compute a scaled prestige value between 0 and 1 that will be used to 
-            #   interpolate between the low-prestige (red) and high-prestige (blue)
-            #   colors.
-            if self.allow_negative_prestige:
-                prestige_scaled = 1/(1 + np.exp(-self.prestige/self.prestige_scale))
-            else:
-                prestige_scaled = np.tanh(self.prestige/self.prestige_scale)
-
-            new_color = (
-                    prestige_scaled * blue +
-                    (1.-prestige_scaled) * red
-                ).astype(np.int)
-
-            grey_pixels = (np.diff(tile, axis=-1)==0).all(axis=-1)
-
-            alpha = tile[...,0].astype(np.uint16)[...,None]
-            tile = np.right_shift(alpha * new_color, 8).astype(np.uint8)
-            return tile
+            return tint_tile(tile, self.prestige_color())
         else:
             return tile
 
+    def render_post_key(self):
+        # Everything render_post depends on, for caching the tinted tile. The tint is already
+        #  quantized (see PRESTIGE_TINT_LEVELS), so nearby prestige values share tiles.
+        if self.active and self.color == 'prestige':
+            return self._tint()[1]
+        return None
+
+    def prestige_color(self):
+        return self._tint()[0]
+
+    # (prestige, scale, allow_negative), color array, color tuple of the last tint computed.
+    _tint_cache = (None, None, None)
+
+    def _tint(self):
+        # Prestige changes at most once a step, but the tint is looked up every time the agent
+        #  is in a rendered view, so keep the last one.
+        params = (self.prestige, self.prestige_scale, self.allow_negative_prestige)
+        cached_params, color, color_key = self._tint_cache
+        if cached_params != params:
+            color = prestige_color(*params)
+            color.setflags(write=False)
+            color_key = tuple(color.tolist())
+            self._tint_cache = (params, color, color_key)
+        return color, color_key
+
     def clone(self):
         ret =  self.__class__(
             view_size = self.view_size,
@@ -295,13 +331,65 @@ class GridAgentInterface(GridAgent):
             return np.full(opacity_grid.shape, 1, dtype=np.bool)
     
 
-@numba.njit
+# Prestige tints are rounded to this many steps between red and blue, so that agents with
+#  color='prestige' are drawn with one of a small fixed set of tiles (see TileAtlas).
+PRESTIGE_TINT_LEVELS = 32
+
+def prestige_color(prestige, prestige_scale, allow_negative_prestige):
+    '''
+    Interpolate between the low-prestige (red) and high-prestige (blue) colors.
+    Works elementwise on arrays of prestige values, in which case the colors are
+        stacked along the last axis.
+    '''
+    blue = np.array([0,0,255])
+    red = np.array([255,0,0])
+    prestige = np.asarray(prestige, dtype=float)
+    if allow_negative_prestige:
+        prestige_scaled = 1/(1 + np.exp(-prestige/prestige_scale))
+    else:
+        prestige_scaled = np.tanh(prestige/prestige_scale)
+    prestige_scaled = np.round(prestige_scaled * PRESTIGE_TINT_LEVELS) / PRESTIGE_TINT_LEVELS
+    prestige_scaled = np.asarray(prestige_scaled)[..., None]
+
+    return (
+            prestige_scaled * blue +
+            (1.-prestige_scaled) * red
+        ).astype(np.int64)
+
+
+def prestige_levels(prestige_scale, allow_negative_prestige):
+    '''
+    One prestige value for each of the PRESTIGE_TINT_LEVELS + 1 tints prestige_color returns
+        for non-negative blends of red and blue (from all red to all blue).
+    '''
+    scaled = (np.arange(PRESTIGE_TINT_LEVELS + 1) / PRESTIGE_TINT_LEVELS).clip(1e-6, 1 - 1e-6)
+    if allow_negative_prestige:
+        return prestige_scale * np.log(scaled / (1 - scaled))
+    return prestige_scale * np.arctanh(scaled)
+
+
+def tint_tile(tile, color):
+    '''
+    Recolor a (monochrome) agent tile, using its red channel as the intensity.
+    '''
+    alpha = tile[...,0].astype(np.uint16)[...,None]
+    return np.right_shift(alpha * color, 8).astype(np.uint8)
+
+
+@numba.njit(nogil=True)
 def occlude_mask(grid, agent_pos):
     mask = np.zeros(grid.shape[:2]).astype(numba.boolean)
+    return _occlude_into(grid, agent_pos, mask)
+
+
+@numba.njit(nogil=True)
+def _occlude_into(grid, agent_pos, mask):
     mask[agent_pos[0], agent_pos[1]] = True
     width, height = grid.shape[:2]
 
-    for j in range(agent_pos[1]+1,0,-1):
+    # Clamp the starting row/column: with view_offset=0 the agent sits on the last row of
+    #  its view, and reading one row past it would pick up uninitialized memory.
+    for j in range(min(agent_pos[1]+1, height-1),0,-1):
         for i in range(agent_pos[0], width):
             if mask[i,j] and grid[i,j]:
                 if i < width - 1:
@@ -311,7 +399,7 @@ def occlude_mask(grid, agent_pos):
                     if i < width - 1:
                         mask[i + 1, j - 1] = True
 
-        for i in range(agent_pos[0]+1,0,-1):
+        for i in range(min(agent_pos[0]+1, width-1),0,-1):
             if mask[i,j] and grid[i,j]:    
                 if i > 0:
                     mask[i - 1, j] = True
@@ -331,7 +419,7 @@ def occlude_mask(grid, agent_pos):
                     if i < width - 1:
                         mask[i + 1, j + 1] = True
 
-        for i in range(agent_pos[0]+1,0,-1):
+        for i in range(min(agent_pos[0]+1, width-1),0,-1):
             if mask[i,j] and grid[i,j]:
                 if i > 0:
                     mask[i - 1, j] = True
@@ -340,4 +428,33 @@ def occlude_mask(grid, agent_pos):
                     if i > 0:
                         mask[i - 1, j + 1] = True
                     
-    return mask
\ No newline at end of file
+    return mask
+
+
+def _occlude_masks(transparent, agent_pos, see_through_walls, masks):
+    for k in numba.prange(transparent.shape[0]):
+        if see_through_walls[k]:
+            masks[k] = True
+        else:
+            _occlude_into(transparent[k], agent_pos, masks[k])
+    return masks
+
+_occlude_masks_serial = numba.njit(nogil=True)(_occlude_masks)
+_occlude_masks_parallel = numba.njit(nogil=True, parallel=True)(_occlude_masks)
+
+
+def occlude_masks(transparent, agent_pos, see_through_walls=False, parallel=False):
+    '''
+    occlude_mask for a whole stack of views at once: transparent is (..., V, V), e.g.
+        (n_agents, V, V) for one env or (B, n_agents, V, V) across envs, and all views share
+        the agent position agent_pos. see_through_walls is broadcast over the leading axes;
+        views where it's set are entirely visible.
+    With parallel=True the views are split across numba's thread pool (prange). Leave it off
+        when calling from several Python threads at once.
+    '''
+    shape = transparent.shape
+    transparent = np.ascontiguousarray(transparent.reshape(-1, *shape[-2:]), dtype=np.bool_)
+    see_through_walls = np.ascontiguousarray(np.broadcast_to(see_through_walls, shape[:-2]).reshape(-1))
+    masks = np.zeros(transparent.shape, dtype=np.bool_)
+    kernel = _occlude_masks_parallel if parallel else _occlude_masks_serial
+    return kernel(transparent, np.asarray(agent_pos, dtype=np.int64), see_through_walls, masks).reshape(shape)
@@ -0,0 +1,208 @@
+import collections
+import threading
+import numpy as np
+
+from .objects import COLORS
+
+
+class TileAtlas:
+    '''
+    Every distinct tile rendered so far at one tile size, stored in a single array with all
+        four orientations pre-rotated: tiles[orientation, id] is the (ts, ts, 3) image of tile
+        `id`, rotated like rotate_grid(tile, orientation).
+
+    Renderers map each cell of a grid to a tile id (usually through a lookup table over the
+        grid's keys), and compose() turns the array of ids into an image with a single gather
+        and reshape. Id 0 is the shadow drawn over cells that aren't visible.
+
+    Tiles are added by index(key, render_fn, *args), which calls render_fn only the first
+        time it sees `key`. Entries are never removed, so ids stay valid. The number of
+        tiles is still bounded: an env draws finitely many (class, color, state) objects,
+        and agents with color='prestige' are tinted with one of a fixed set of colors (see
+        agents.PRESTIGE_TINT_LEVELS). hits and misses count index() lookups.
+    '''
+    SHADOW = 0
+
+    def __init__(self, tile_size, palette=None, capacity=64):
+        self.tile_size = tile_size
+        self.palette = palette
+        self.tiles = np.zeros((4, capacity, tile_size, tile_size, 3), dtype=np.uint8)
+        self.n_tiles = 0
+        self.ids = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        # Palette indices of the first n_indexed tiles (see compose(..., paletted=True)).
+        self.indexed = np.zeros((4, capacity, tile_size, tile_size), dtype=np.uint8)
+        self.n_indexed = 0
+
+        shadow = np.zeros((tile_size, tile_size, 3), dtype=np.uint8) + COLORS['shadow'].astype(np.uint8)
+        self.index('shadow', lambda: shadow)
+
+    def __len__(self):
+        return self.n_tiles
+
+    def index(self, key, render_fn, *args, **kwargs):
+        ix = self.ids.get(key)
+        if ix is None:
+            with self.lock:
+                ix = self.ids.get(key)
+                if ix is None:
+                    self.misses += 1
+                    ix = self._add(render_fn(*args, **kwargs))
+                    self.ids[key] = ix
+                    return ix
+        self.hits += 1
+        return ix
+
+    def stats(self):
+        return {
+            'size': self.n_tiles,
+            'hits': self.hits,
+            'misses': self.misses,
+            'nbytes': self.tiles[:, :self.n_tiles].nbytes,
+        }
+
+    def _add(self, tile):
+        ix = self.n_tiles
+        if ix == self.tiles.shape[1]:
+            tiles = np.zeros((4, 2 * ix, *self.tiles.shape[2:]), dtype=np.uint8)
+            tiles[:, :ix] = self.tiles
+            # Swap in the new array in one assignment; concurrent readers keep using the old one.
+            self.tiles = tiles
+        for orientation in range(4):
+            self.tiles[orientation, ix] = np.rot90(tile, k=-orientation) if orientation else tile
+        self.n_tiles += 1
+        return ix
+
+    def _index_palette(self):
+        with self.lock:
+            n, start = self.n_tiles, self.n_indexed
+            if start == n:
+                return self.indexed
+            indexed = self.indexed
+            if n > indexed.shape[1]:
+                indexed = np.zeros((4, self.tiles.shape[1], *indexed.shape[2:]), dtype=np.uint8)
+                indexed[:, :start] = self.indexed[:, :start]
+            indexed[:, start:n] = self.palette.index(self.tiles[:, start:n])
+            self.indexed = indexed
+            self.n_indexed = n
+            return indexed
+
+    def compose(self, ids, orientation=0, highlight_mask=None, paletted=False):
+        '''
+        Assemble images from an (..., W, H) array of tile ids. orientation is a scalar or an
+            array broadcastable to the leading (...) axes. Cell (i, j) covers rows
+            j*ts:(j+1)*ts and columns i*ts:(i+1)*ts of the (..., H*ts, W*ts, 3) result.
+
+        Cells where highlight_mask is set are brightened like in MultiGridEnv.render. With
+            paletted=True the result holds (..., H*ts, W*ts) indices into self.palette.
+        '''
+        ts = self.tile_size
+        orientation = (np.asarray(orientation) % 4)[..., None, None]
+        if paletted and highlight_mask is None:
+            cells = self._index_palette()[orientation, ids][..., None]
+        else:
+            cells = self.tiles[orientation, ids]
+            if highlight_mask is not None:
+                cells[highlight_mask] = highlight(cells[highlight_mask])
+
+        # (..., W, H, ts, ts, C) -> (..., H, ts, W, ts, C) -> (..., H*ts, W*ts, C)
+        *lead, W, H = ids.shape
+        n = len(lead)
+        img = np.moveaxis(cells, (n, n + 1), (n + 2, n)).reshape(*lead, H * ts, W * ts, cells.shape[-1])
+
+        if paletted:
+            return img[..., 0] if highlight_mask is None else self.palette.index(img)
+        return img
+
+
+class TileCache:
+    '''
+    Bounded LRU cache of rendered tiles (see MultiGrid.cache_render_fun).
+
+    Tiles are stored read-only and returned without copying, so take a copy before drawing
+        on one. When there are more than maxsize tiles the least recently used one is
+        evicted. hits, misses and evictions count lookups since the last clear().
+    '''
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def get(self, key, render_fn, *args, **kwargs):
+        '''
+        The tile cached under key, rendering it with render_fn(*args, **kwargs) on a miss.
+        '''
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+            tile = np.array(render_fn(*args, **kwargs))
+            tile.setflags(write=False)
+            self.tiles[key] = tile
+            while len(self.tiles) > self.maxsize:
+                self.tiles.popitem(last=False)
+                self.evictions += 1
+            return tile
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self.tiles),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def highlight(cells):
+    return np.right_shift(cells.astype(np.uint16) * 8 + 255 * 2, 3).clip(0, 255).astype(np.uint8)
+
+
+class Framebuffer:
+    '''
+    A persistent RGB image of a (width, height) grid of atlas tiles. update() redraws only
+        the cells whose tile id or highlight changed since the previous call.
+
+    Atlas ids identify what a tile looks like, so comparing them catches everything that
+        changes a cell's image - objects being set, agents moving or turning, prestige tints -
+        without having to hook each of those.
+    '''
+    def __init__(self, atlas, width, height, orientation=0):
+        ts = atlas.tile_size
+        self.atlas = atlas
+        self.orientation = orientation % 4
+        self.ids = np.full((width, height), -1, dtype=np.int64)
+        self.highlight_mask = np.zeros((width, height), dtype=bool)
+        self.img = np.zeros((height * ts, width * ts, 3), dtype=np.uint8)
+
+    def update(self, ids, highlight_mask=None):
+        if highlight_mask is None:
+            highlight_mask = np.zeros(ids.shape, dtype=bool)
+        x, y = np.nonzero((ids != self.ids) | (highlight_mask != self.highlight_mask))
+        if len(x):
+            cells = self.atlas.tiles[self.orientation, ids[x, y]]
+            hl = highlight_mask[x, y]
+            cells[hl] = highlight(cells[hl])
+            ts = self.atlas.tile_size
+            width, height = ids.shape
+            # Rows j*ts:(j+1)*ts, columns i*ts:(i+1)*ts of cell (i, j).
+            self.img.reshape(height, ts, width, ts, 3)[y, :, x, :] = cells
+            self.ids[x, y] = ids[x, y]
+            self.highlight_mask[x, y] = highlight_mask[x, y]
+        return self.img
@@ -7,10 +7,21 @@ import gym_minigrid
 from enum import IntEnum
 import math
 import warnings
+import threading
+import weakref
+import functools
+import copy
 
 from .objects import Berry, PoisonedBerry, WorldObj, Wall, Goal, Lava, GridAgent, BonusTile, BulkObj, COLORS
-from .agents import GridAgentInterface
+from .agents import GridAgentInterface, occlude_masks, prestige_levels
 from .rendering import SimpleImageViewer
+from .kernels import extract_view, gather_views, move_agents
+from .atlas import TileAtlas, TileCache, Framebuffer
+from .palette import Palette
+from .compositor import Compositor
+from .occupancy import AgentIndex
+from .layouts import LayoutPool
+from .perf import PerfStats, perf_counter_ns
 from gym_minigrid.rendering import fill_coords, point_in_rect, downsample, highlight_img
 
 TILE_PIXELS = 8
@@ -21,31 +32,111 @@ class ObjectRegistry:
     This class contains dicts that map objects to numeric keys and vise versa.
     Used so that grid worlds can represent objects using numerical arrays rather 
         than lists of lists of generic objects.
+    It also keeps per-key arrays of the properties the hot paths need (whether an object
+        blocks sight, whether agents can move onto it, whether it's an agent, its encoding),
+        so that e.g. the opacity of a whole grid is just `obj_reg.opaque[grid]`.
+    These are computed when an object is added, and recomputed for that object alone when
+        its state or color changes (objects notify the registries holding them; see
+        WorldObj.changed).
+
+    The grid that created the registry counts how many of its cells hold each key. When
+        an object's count drops to zero (it was picked up, or it was an agent that left the
+        grid) its key goes on a free list and gets reused, so the number of keys stays
+        bounded by the number of objects on the grid at once. Slices of the grid share
+        the registry but don't count references.
     '''
     def __init__(self, objs=[], max_num_objects=1000):
         self.key_to_obj_map = {}
         self.obj_to_key_map = {}
         self.max_num_objects = max_num_objects
+        self.next_key = 0
+        self.free_keys = []
+        self.refcount = np.zeros(16, dtype=np.int64)
+        self.opaque = np.zeros(16, dtype=bool)
+        self.overlappable = np.ones(16, dtype=bool)
+        self.is_agent = np.zeros(16, dtype=bool)
+        # (type, color, state) as in WorldObj.encode.
+        self.encoding = np.zeros((16, 3), dtype=np.uint8)
+        # Weak reference to the grid that owns the registry, which keeps a copy of the
+        #  encodings per cell (MultiGrid.cells) that refresh has to update.
+        self.owner = None
         for obj in objs:
             self.add_object(obj)
 
     def get_next_key(self):
-        for k in range(self.max_num_objects):
-            if k not in self.key_to_obj_map:
-                break
-        else:
+        if self.free_keys:
+            return self.free_keys.pop()
+        if self.next_key >= self.max_num_objects:
             raise ValueError("Object registry full.")
-        return k
+        self.next_key += 1
+        return self.next_key - 1
 
     def __len__(self):
-        return len(self.id_to_obj_map)
+        return len(self.key_to_obj_map)
 
     def add_object(self, obj):
         new_key = self.get_next_key()
         self.key_to_obj_map[new_key] = obj
         self.obj_to_key_map[obj] = new_key
+        self.track(obj)
+        self._set_properties(new_key, obj)
         return new_key
 
+    def track(self, obj):
+        # Have obj call refresh(obj) when its state or color changes. Agents aren't tracked;
+        #  their properties don't depend on either.
+        if obj is not None and not obj.is_agent:
+            if not obj._registries:
+                obj._registries = weakref.WeakSet()
+            obj._registries.add(self)
+
+    def remove_key(self, key):
+        obj = self.key_to_obj_map.pop(key)
+        if self.obj_to_key_map.get(obj) == key:
+            del self.obj_to_key_map[obj]
+            if obj is not None and obj._registries:
+                obj._registries.discard(self)
+        self.refcount[key] = 0
+        self.free_keys.append(key)
+
+    def incref(self, key):
+        self.refcount[key] += 1
+
+    def decref(self, key):
+        self.refcount[key] -= 1
+        # None (the empty cell) keeps its key.
+        if self.refcount[key] <= 0 and self.key_to_obj_map[key] is not None:
+            self.remove_key(key)
+
+    def _grow(self, capacity):
+        if capacity <= len(self.opaque):
+            return
+        def grow(arr, fill):
+            ret = np.full((capacity, *arr.shape[1:]), fill, dtype=arr.dtype)
+            ret[:len(arr)] = arr
+            return ret
+        self.refcount = grow(self.refcount, 0)
+        self.opaque = grow(self.opaque, False)
+        self.overlappable = grow(self.overlappable, True)
+        self.is_agent = grow(self.is_agent, False)
+        self.encoding = grow(self.encoding, 0)
+
+    def _set_properties(self, key, obj):
+        if key >= len(self.opaque):
+            self._grow(max(key + 1, 2 * len(self.opaque)))
+        self.opaque[key] = (obj is not None) and not obj.see_behind()
+        self.overlappable[key] = (obj is None) or obj.can_overlap()
+        self.is_agent[key] = bool(getattr(obj, 'is_agent', False))
+        self.encoding[key] = (0, 0, 0) if obj is None else obj.encode()
+
+    def refresh(self, obj):
+        key = self.obj_to_key_map.get(obj)
+        if key is not None:
+            self._set_properties(key, obj)
+            grid = self.owner() if self.owner is not None else None
+            if grid is not None:
+                grid.refresh_cells(key)
+
     def contains_object(self, obj):
         return obj in self.obj_to_key_map
 
@@ -80,9 +171,39 @@ def rotate_grid(grid, rot_k):
         return grid
 
 
+@functools.lru_cache(maxsize=None)
+def view_offsets(view_size, view_offset):
+    '''
+    For each direction, the (dx, dy) offsets from an agent's position to each cell of its
+        egocentric (view_size, view_size) window, in the layout that
+        MultiGrid.slice(..., rot_k=dir+1) produces. Shape (4, 2, view_size, view_size).
+    '''
+    V = view_size
+    top = {
+        0: (-view_offset, -(V // 2)),
+        1: (-(V // 2), -view_offset),
+        2: (-V + 1 + view_offset, -(V // 2)),
+        3: (-(V // 2), -V + 1 + view_offset),
+    }
+    sx, sy = np.meshgrid(np.arange(V), np.arange(V), indexing='ij')
+    offsets = np.zeros((4, 2, V, V), dtype=np.int64)
+    for d in range(4):
+        offsets[d, 0] = top[d][0] + rotate_grid(sx, d + 1)
+        offsets[d, 1] = top[d][1] + rotate_grid(sy, d + 1)
+    offsets.setflags(write=False)
+    return offsets
+
+
 class MultiGrid:
 
-    tile_cache = {}
+    # Tiles of single objects, shared by every grid; see atlas.TileCache and warm_tile_cache.
+    tile_cache = TileCache(maxsize=4096)
+    # Guards atlases, so that envs can render from several threads.
+    tile_cache_lock = threading.Lock()
+    # Colors of paletted renders (see render(..., paletted=True)).
+    palette = Palette()
+    # tile_size -> TileAtlas of the tiles rendered by render().
+    atlases = {}
 
     def __init__(self, shape, obj_reg=None, orientation=0):
         self.orientation = orientation
@@ -98,12 +219,104 @@ class MultiGrid:
         if self.width < 3 or self.height < 3:
             raise ValueError("Grid needs width, height >= 3")
 
+        # Only the grid that creates the registry counts references to keys (see ObjectRegistry).
+        self.owns_registry = obj_reg is None
         self.obj_reg = ObjectRegistry(objs=[None]) if obj_reg is None else obj_reg
+        # tile_size -> Framebuffer kept by render(..., incremental=True).
+        self.framebuffers = {}
+        if self.owns_registry:
+            self.obj_reg.owner = weakref.ref(self)
+            # (type, color, state) of each cell, as in encode (see refresh_cells).
+            self.cells = self.obj_reg.encoding[self.grid]
+            self.obj_reg.refcount[0] = np.count_nonzero(self.grid == 0)
+            # Empty cells (flat index i*height + j), kept as a list with swap-removal so that
+            #  place_obj can sample one in O(1). free_slot maps a flat index to its position
+            #  in free_cells, or -1.
+            self.free_cells = np.flatnonzero(self.grid.ravel() == 0).tolist()
+            self.free_slot = [-1] * self.grid.size
+            for slot, f in enumerate(self.free_cells):
+                self.free_slot[f] = slot
+
+    @classmethod
+    def from_layout(cls, keys, objects):
+        '''
+        A grid (with its own registry) holding a copy of the key array `keys`, in which key
+            k+1 is objects[k] and 0 is empty.
+        '''
+        grid = cls(np.array(keys, dtype=np.promote_types(keys.dtype, np.uint8)))
+        for obj in objects:
+            obj.agents = []
+            grid.obj_reg.add_object(obj)
+        grid.obj_reg.refcount[:len(objects) + 1] = np.bincount(grid.grid.ravel(), minlength=len(objects) + 1)
+        grid.cells = grid.obj_reg.encoding[grid.grid]
+        return grid
+
+    def get_state(self):
+        '''
+        The grid as a dict of small arrays and lists: the key array and the registry's
+            bookkeeping. Objects are referenced, not copied; MultiGridEnv.get_state also
+            saves their attributes.
+        Derived data (the registry's property arrays, the per-cell encodings, render
+            framebuffers) is left out and rebuilt by from_state.
+        '''
+        reg = self.obj_reg
+        state = {
+            'grid': self.grid.copy(),
+            'orientation': self.orientation,
+            'owns_registry': self.owns_registry,
+            'objects': dict(reg.key_to_obj_map),
+            'next_key': reg.next_key,
+            'free_keys': list(reg.free_keys),
+            'refcount': reg.refcount.copy(),
+            'max_num_objects': reg.max_num_objects,
+        }
+        if self.owns_registry:
+            # The order of the free list decides where place_obj puts things.
+            state['free_cells'] = list(self.free_cells)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        grid = cls.__new__(cls)
+        grid.__setstate__(state)
+        return grid
+
+    def __getstate__(self):
+        return self.get_state()
+
+    def __setstate__(self, state):
+        self.grid = state['grid'].copy()
+        self.width, self.height = self.grid.shape
+        self.orientation = state['orientation']
+        self.owns_registry = state['owns_registry']
+        self.framebuffers = {}
+
+        reg = self.obj_reg = ObjectRegistry(max_num_objects=state['max_num_objects'])
+        reg._grow(len(state['refcount']))
+        reg.refcount[:len(state['refcount'])] = state['refcount']
+        for key, obj in state['objects'].items():
+            reg.key_to_obj_map[key] = obj
+            reg.obj_to_key_map[obj] = key
+            reg.track(obj)
+            reg._set_properties(key, obj)
+        reg.next_key = state['next_key']
+        reg.free_keys = list(state['free_keys'])
+
+        if self.owns_registry:
+            reg.owner = weakref.ref(self)
+            self.cells = reg.encoding[self.grid]
+            self.free_cells = list(state['free_cells'])
+            self.free_slot = [-1] * self.grid.size
+            for slot, f in enumerate(self.free_cells):
+                self.free_slot[f] = slot
 
     @property
     def opacity(self):
-        transparent_fun = np.vectorize(lambda k: (self.obj_reg.key_to_obj_map[k].see_behind() if hasattr(self.obj_reg.key_to_obj_map[k], 'see_behind') else True))
-        return ~transparent_fun(self.grid)
+        return self.obj_reg.opaque[self.grid]
+
+    @property
+    def overlappable(self):
+        return self.obj_reg.overlappable[self.grid]
 
     def __getitem__(self, *args, **kwargs):
         return self.__class__(
@@ -124,32 +337,58 @@ class MultiGrid:
         """
         Get a subset of the grid
         """
+        shape = (width, height) if rot_k % 2 == 0 else (height, width)
         sub_grid = self.__class__(
-            (width, height),
+            extract_view(self.grid, topX, topY, width, height, rot_k, np.empty(shape, dtype=self.grid.dtype)),
             obj_reg=self.obj_reg,
             orientation=(self.orientation - rot_k) % 4,
         )
-        x_min = max(0, topX)
-        x_max = min(topX + width, self.width)
-        y_min = max(0, topY)
-        y_max = min(topY + height, self.height)
-
-        x_offset = x_min - topX
-        y_offset = y_min - topY
-        sub_grid.grid[
-            x_offset : x_max - x_min + x_offset, y_offset : y_max - y_min + y_offset
-        ] = self.grid[x_min:x_max, y_min:y_max]
-
-        sub_grid.grid = rotate_grid(sub_grid.grid, rot_k)
-
-        sub_grid.width, sub_grid.height = sub_grid.grid.shape
-
         return sub_grid
 
+    def agent_views(self, pos, dirs, view_size, view_offset):
+        '''
+        Keys in the view windows of several agents at once, as a contiguous
+            (n_agents, view_size, view_size) array laid out like
+            slice(*agent.get_view_exts()[:2], view_size, view_size, rot_k=agent.dir+1) for each.
+        pos is (n_agents, 2) and dirs (n_agents,). Cells outside the grid are 0 (empty).
+        '''
+        offsets = view_offsets(view_size, view_offset)[np.asarray(dirs)]
+        return gather_views(
+            self.grid, np.asarray(pos, dtype=np.int64), offsets,
+            np.empty((len(offsets), view_size, view_size), dtype=self.grid.dtype)
+        )
+
     def set(self, i, j, obj):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        self.grid[i, j] = self.obj_reg.get_key(obj)
+        key = self.obj_reg.get_key(obj)
+        if self.owns_registry:
+            if key > np.iinfo(self.grid.dtype).max:
+                # Keys outgrew the grid dtype; promote rather than letting them wrap around.
+                self.grid = self.grid.astype(np.promote_types(self.grid.dtype, np.min_scalar_type(key)))
+            old_key = self.grid[i, j]
+            self.obj_reg.incref(key)
+            self.obj_reg.decref(old_key)
+            if (old_key == 0) != (key == 0):
+                self._update_free(i * self.height + j, free=(key == 0))
+            self.cells[i, j] = self.obj_reg.encoding[key]
+        self.grid[i, j] = key
+
+    def refresh_cells(self, key):
+        # The object with this key changed (see ObjectRegistry.refresh).
+        self.cells[self.grid == key] = self.obj_reg.encoding[key]
+
+    def _update_free(self, f, free):
+        if free:
+            self.free_slot[f] = len(self.free_cells)
+            self.free_cells.append(f)
+        else:
+            slot = self.free_slot[f]
+            last = self.free_cells.pop()
+            if last != f:
+                self.free_cells[slot] = last
+                self.free_slot[last] = slot
+            self.free_slot[f] = -1
 
     def get(self, i, j):
         assert i >= 0 and i < self.width
@@ -197,20 +436,18 @@ class MultiGrid:
         """
         Produce a compact numpy encoding of the grid
         """
-
-        if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
-
-        array = np.zeros((self.width, self.height, 3), dtype="uint8")
-
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
-                    if v is None:
-                        array[i, j, :] = 0
-                    else:
-                        array[i, j, :] = v.encode()
+        reg = self.obj_reg
+        # Grids that own their registry keep the encodings per cell; views of them (slices,
+        #  agent views) look them up by key.
+        array = self.cells.copy() if self.owns_registry else reg.encoding[self.grid]
+        # Agents' encodings change whenever they turn, so theirs are looked up here rather
+        #  than kept in the registry.
+        agent_cells = reg.is_agent[self.grid]
+        if agent_cells.any():
+            array[agent_cells] = [reg.key_to_obj_map[key].encode() for key in self.grid[agent_cells]]
+
+        if vis_mask is not None:
+            array[~vis_mask] = 0
         return array
 
     @classmethod
@@ -224,9 +461,8 @@ class MultiGrid:
     
     @classmethod
     def cache_render_fun(cls, key, f, *args, **kwargs):
-        if key not in cls.tile_cache:
-            cls.tile_cache[key] = f(*args, **kwargs)
-        return np.copy(cls.tile_cache[key])
+        # The cached tile itself, which is read-only.
+        return cls.tile_cache.get(key, f, *args, **kwargs)
 
     @classmethod
     def cache_render_obj(cls, obj, tile_size, subdivs):
@@ -263,13 +499,14 @@ class MultiGrid:
         This function renders one "tile" on top of another. Kinda janky, works surprisingly well.
         Assumes img2 is a downscaled monochromatic with a black (0,0,0) background.
         '''
-        alpha = img2.sum(2, keepdims=True)
+        alpha = img2.sum(2, keepdims=True, dtype=np.int64)
         max_alpha = alpha.max()
         if max_alpha == 0:
             return img1
+        # Integer division truncates like the float division and cast it replaces.
         return (
             ((img1 * (max_alpha-alpha))+(img2*alpha)
-            )/max_alpha
+            )//max_alpha
         ).astype(img1.dtype)
 
     @classmethod
@@ -298,39 +535,171 @@ class MultiGrid:
                 img = img + cls.cache_render_fun((tile_size, None), cls.empty_tile, tile_size, subdivs)
         return img
 
-    def render(self, tile_size, highlight_mask=None, visible_mask=None, top_agent=None):
-        width_px = self.width * tile_size
-        height_px = self.height * tile_size
-
-        img = np.zeros(shape=(height_px, width_px), dtype=np.uint8)[...,None]+COLORS['shadow']
-
-        for j in range(0, self.height):
-            for i in range(0, self.width):
-                if visible_mask is not None and not visible_mask[i,j]:
-                    continue
-                obj = self.get(i, j)
+    @classmethod
+    def warm_tile_cache(cls, env, tile_sizes=(TILE_PIXELS,)):
+        '''
+        Render ahead of time the tiles env can show: the empty cell; each class of object on
+            its current grid or carried by an agent, in every color and state (the members of
+            its `states` enum, like door states, or else the states seen on the grid); every
+            agent facing each direction (with each tint, for color='prestige'); and every
+            agent standing on each object it can overlap. They are rendered at each agent's
+            view_tile_size and at each of tile_sizes (the tile_size of env.render), into
+            tile_cache and the atlases, so the first episodes in a new process don't pay for it.
+        '''
+        tile_sizes = sorted({agent.view_tile_size for agent in env.agents} | set(tile_sizes))
 
-                tile_img = MultiGrid.render_tile(
-                    obj,
-                    tile_size=tile_size,
-                    top_agent=top_agent
+        def warm(obj, top_agent=None):
+            for tile_size in tile_sizes:
+                cls.cache_render_obj(obj, tile_size, 3)
+                cls.get_atlas(tile_size).index(
+                    cls.tile_key(obj, top_agent), cls.render_tile, obj, tile_size=tile_size, top_agent=top_agent
                 )
 
-                ymin = j * tile_size
-                ymax = (j + 1) * tile_size
-                xmin = i * tile_size
-                xmax = (i + 1) * tile_size
+        objects = [obj for obj in env.grid.obj_reg.key_to_obj_map.values() if obj is not None and not obj.is_agent]
+        objects += [agent.carrying for agent in env.agents if agent.carrying is not None]
+        by_class = {}
+        for obj in objects:
+            by_class.setdefault(type(obj), []).append(obj)
+        variants = []
+        for objs in by_class.values():
+            states = getattr(type(objs[0]), 'states', None)
+            states = list(dict.fromkeys(obj.state for obj in objs)) if states is None else list(states)
+            for color in COLORS:
+                if color == 'shadow':
+                    continue
+                for state in states:
+                    variant = copy.copy(objs[0])
+                    variant.color = color
+                    variant.state = state
+                    variant.agents = []
+                    variants.append(variant)
+
+        agents = {}
+        for agent in env.agents:
+            variant = copy.copy(agent)
+            variant.active = True
+            variant.agents = []
+            if agent.color == 'prestige':
+                prestiges = prestige_levels(agent.prestige_scale, agent.allow_negative_prestige)
+            else:
+                prestiges = [agent.prestige]
+            for prestige in prestiges:
+                for dir in range(4):
+                    variant.prestige = prestige
+                    variant.dir = dir
+                    key = cls.appearance_key(variant)
+                    if key not in agents:
+                        agents[key] = variant
+                        variant = copy.copy(variant)
+
+        warm(None)
+        for obj in variants:
+            warm(obj)
+        for agent in agents.values():
+            warm(agent)
+            # As drawn in the agent's own view, or on top of a stack of agents.
+            agent.agents = [agent]
+            warm(agent, top_agent=agent)
+            agent.agents = []
+        for obj in variants:
+            if obj.can_overlap():
+                for agent in agents.values():
+                    obj.agents = [agent]
+                    warm(obj)
+                obj.agents = []
 
-                img[ymin:ymax, xmin:xmax, :] = rotate_grid(tile_img, self.orientation)
-        
-        if highlight_mask is not None:
-            hm = np.kron(highlight_mask.T, np.full((tile_size, tile_size), 255, dtype=np.uint16)
-                )[...,None] # arcane magic.
-            img = np.right_shift(img.astype(np.uint16)*8+hm*2, 3).clip(0,255).astype(np.uint8)
+    @classmethod
+    def get_atlas(cls, tile_size):
+        atlas = cls.atlases.get(tile_size)
+        if atlas is None:
+            with cls.tile_cache_lock:
+                atlas = cls.atlases.setdefault(tile_size, TileAtlas(tile_size, palette=cls.palette))
+        return atlas
+
+    @staticmethod
+    def appearance_key(obj):
+        # What cache_render_obj draws for obj.
+        post = obj.render_post_key() if hasattr(obj, 'render_post_key') else None
+        return (obj.__class__.__name__, *obj.encode(), post)
 
-        return img
+    @classmethod
+    def tile_key(cls, obj, top_agent=None):
+        '''
+        Hashable description of the tile render_tile(obj, top_agent=top_agent) draws, following
+            the same cases.
+        '''
+        if obj is None:
+            return None
+        if ('Agent' in obj.type) and (top_agent in obj.agents):
+            return ('agent', cls.appearance_key(top_agent))
+        if len(obj.agents)>0 and 'Agent' not in obj.type:
+            agent = top_agent if top_agent in obj.agents else obj.agents[0]
+            return (cls.appearance_key(obj), cls.appearance_key(agent))
+        return (cls.appearance_key(obj),)
+
+    def render(self, tile_size, highlight_mask=None, visible_mask=None, top_agent=None, paletted=False, incremental=False):
+        '''
+        Render the grid as an RGB image, or with paletted=True as a single-channel image of
+            indices into MultiGrid.palette.
+        With incremental=True (RGB only), the image is kept between calls and only the cells
+            whose tile or highlight changed are redrawn (see atlas.Framebuffer).
+        '''
+        atlas = self.get_atlas(tile_size)
+
+        # Look up (or render) the atlas tile of each distinct visible key, then assemble the
+        #  image with a single gather.
+        keys = np.unique(self.grid) if visible_mask is None else np.unique(self.grid[visible_mask])
+        lut = np.zeros(int(keys.max()) + 1 if len(keys) else 1, dtype=np.int64)
+        for key in keys:
+            obj = self.obj_reg.key_to_obj_map[key]
+            lut[key] = atlas.index(
+                self.tile_key(obj, top_agent), MultiGrid.render_tile, obj, tile_size=tile_size, top_agent=top_agent
+            )
+        tile_ids = np.full((self.width, self.height), TileAtlas.SHADOW, dtype=np.int64)
+        if visible_mask is None:
+            tile_ids = lut[self.grid]
+        else:
+            tile_ids[visible_mask] = lut[self.grid[visible_mask]]
+
+        if incremental and not paletted:
+            fb = self.framebuffers.get(tile_size)
+            if fb is None or fb.ids.shape != tile_ids.shape or fb.orientation != self.orientation % 4:
+                fb = self.framebuffers[tile_size] = Framebuffer(atlas, self.width, self.height, self.orientation)
+            return fb.update(tile_ids, highlight_mask).copy()
+
+        return atlas.compose(tile_ids, self.orientation, highlight_mask=highlight_mask, paletted=paletted)
+
+
+def _copy_attrs(attrs):
+    # Copy of an object's __dict__, one level deep (lists like agent.bonuses or obj.agents
+    #  are mutated in place).
+    ret = {}
+    for k, v in attrs.items():
+        if k == '_registries':
+            # Registries track their objects themselves (see ObjectRegistry.track).
+            continue
+        if isinstance(v, (list, dict, set)):
+            v = type(v)(v)
+        elif isinstance(v, np.ndarray):
+            v = v.copy()
+        ret[k] = v
+    return ret
 
 class MultiGridEnv(gym.Env):
+    # PerfStats collecting the duration of each phase of step/reset, or None (the default)
+    #  to skip timing. See enable_perf_stats.
+    perf = None
+    # LayoutPool that resets restore grids from, or None (the default) to call _gen_grid on
+    #  every reset. See enable_layout_pool.
+    layout_pool = None
+    # Whether step runs movement-only steps through the compiled move_agents kernel (see
+    #  _step_compiled). Turn off to always use the Python loop.
+    compiled_step = True
+    # (grid, step_count, obs_grids, obs) of the last gen_obs; see current_views.
+    _views = None
+    # Compositor that render assembles the grid image and agent views on, made on first use.
+    _compositor = None
+
     def __init__(
         self,
         agents = [],
@@ -360,6 +729,7 @@ class MultiGridEnv(gym.Env):
         self.seed(seed=seed)
         self.agent_spawn_kwargs = agent_spawn_kwargs
         self.ghost_mode = ghost_mode
+        self.agent_index = AgentIndex()
         
         self.agents = []
         for agent in agents:
@@ -398,12 +768,119 @@ class MultiGridEnv(gym.Env):
                 "To add an agent to a marlgrid environment, call add_agent with either a GridAgentInterface object "
                 " or a dictionary that can be used to initialize one.")
 
+    def enable_perf_stats(self, window=10000):
+        '''
+        Start timing the phases of step and reset (and of observation generation, per agent).
+            perf_stats() summarizes the last `window` samples of each phase.
+        '''
+        self.perf = PerfStats(window=window)
+
+    def disable_perf_stats(self):
+        self.perf = None
+
+    def perf_stats(self):
+        '''
+        {phase: {'count', 'mean_us', 'p50_us', 'p95_us', 'p99_us', 'max_us'}}, or {} if timing
+            isn't enabled. Phases are named "step/...", "reset/..." and "obs/...".
+        '''
+        return {} if self.perf is None else self.perf.summary()
+
+    def enable_layout_pool(self, size=64, seed=None, background=False, pool=None):
+        '''
+        Restore grids from a pool of `size` pre-generated layouts on reset instead of generating
+            a new one each time; only the agents' spawns are randomized per episode. Pass `pool`
+            to share an existing LayoutPool between envs of the same class and config.
+        The pool seed defaults to a draw from the env's RNG, so seeded envs stay reproducible.
+        '''
+        if pool is None:
+            if seed is None:
+                seed = int(self.np_random.integers(0, 2**32))
+            pool = LayoutPool(self, size=size, seed=seed, background=background)
+        self.layout_pool = pool
+
+    def disable_layout_pool(self):
+        self.layout_pool = None
+
+    def get_state(self):
+        '''
+        Snapshot of everything that changes while the env runs: the grid's keys, the attributes
+            of the objects on it, of the agents and of what they carry (door states, berry
+            timers, bonus states, prestige, ...), where the agents stand, the step count and
+            the RNG state.
+        set_state(state) rewinds the env to it, e.g. to branch off several rollouts from
+            one point. The snapshot references this env's objects, so it's only meaningful
+            for this env; pickle the env itself to send it elsewhere.
+        '''
+        objects = {}
+        for obj in self.grid.obj_reg.key_to_obj_map.values():
+            if obj is not None:
+                objects[id(obj)] = obj
+        for agent in self.agents:
+            objects[id(agent)] = agent
+            if agent.carrying is not None:
+                objects[id(agent.carrying)] = agent.carrying
+        return {
+            'grid': self.grid.get_state(),
+            'objects': [(obj, _copy_attrs(vars(obj))) for obj in objects.values()],
+            'agent_cells': [(pos, list(stack)) for pos, stack in self.agent_index.cells.items()],
+            'step_count': self.step_count,
+            'agent_spawn_kwargs': dict(self.agent_spawn_kwargs),
+            'rng': self.np_random.bit_generator.state,
+        }
+
+    def set_state(self, state):
+        for obj, attrs in state['objects']:
+            obj.__dict__.clear()
+            obj.__dict__.update(_copy_attrs(attrs))
+        self.grid = type(self.grid).from_state(state['grid'])
+        self.agent_index.clear()
+        for pos, stack in state['agent_cells']:
+            for agent in stack:
+                self.agent_index.add(agent, pos)
+        self.step_count = state['step_count']
+        self.agent_spawn_kwargs = dict(state['agent_spawn_kwargs'])
+        self.np_random.bit_generator.state = state['rng']
+        self._views = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # The render window can't be pickled; a new one is opened when needed.
+        state['window'] = None
+        state.pop('_views', None)
+        state.pop('_compositor', None)
+        if state.get('perf') is not None:
+            # Timings are only meaningful in the process that took them.
+            state['perf'] = PerfStats(window=state['perf'].window)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def reset(self, **kwargs):
+        perf = self.perf
+        if perf: t0 = t = perf_counter_ns()
+        self._reset_world()
+        if perf: t = perf.lap('reset/world', t)
+        obs = self.gen_obs()
+        if perf:
+            perf.lap('reset/obs', t)
+            perf.lap('reset', t0)
+        return obs
+
+    def _reset_world(self):
+        '''
+        Generate a new grid and spawn the agents, without generating observations.
+        Split out of reset so that vectorized envs can reuse the layout generation.
+        '''
         for agent in self.agents:
             agent.agents = []
             agent.reset(new_episode=True)
+        self.agent_index.clear()
 
-        self._gen_grid(self.width, self.height)
+        if self.layout_pool is None:
+            self._gen_grid(self.width, self.height)
+        else:
+            self.layout_pool.restore(self)
 
         for agent in self.agents:
             if agent.spawn_delay == 0:
@@ -411,29 +888,53 @@ class MultiGridEnv(gym.Env):
                 agent.activate()
 
         self.step_count = 0
-        obs = self.gen_obs()
-        return obs
-
-    def gen_obs_grid(self, agent):
-        # If the agent is inactive, return an empty grid and a visibility mask that hides everything.
-        if not agent.active:
-            # below, not sure orientation is correct but as of 6/27/2020 that doesn't matter because
-            # agent views are usually square and this grid won't be used for anything.
-            grid = MultiGrid((agent.view_size, agent.view_size), orientation=agent.dir+1)
-            vis_mask = np.zeros((agent.view_size, agent.view_size), dtype=np.bool)
-            return grid, vis_mask
 
-        topX, topY, botX, botY = agent.get_view_exts()
+    def _rand_int(self, low, high):
+        return self.np_random.integers(low, high)
 
-        grid = self.grid.slice(
-            topX, topY, agent.view_size, agent.view_size, rot_k=agent.dir + 1
-        )
+    def gen_obs_grid(self, agent):
+        return self.gen_obs_grids([agent])[0]
 
-        # Process occluders and visibility
-        # Note that this incurs some slight performance cost
-        vis_mask = agent.process_vis(grid.opacity)
+    def gen_obs_grids(self, agents=None):
+        '''
+        The (grid, vis_mask) view of each agent (all of them by default). The view windows
+            of agents with the same view_size and view_offset are extracted together, with a
+            single gather (see MultiGrid.agent_views).
+        '''
+        agents = self.agents if agents is None else agents
+        ret = [None] * len(agents)
+        groups = {}
+        for k, agent in enumerate(agents):
+            if agent.active:
+                groups.setdefault((agent.view_size, agent.view_offset), []).append(k)
+            else:
+                # If the agent is inactive, return an empty grid and a visibility mask that hides everything.
+                # below, not sure orientation is correct but as of 6/27/2020 that doesn't matter because
+                # agent views are usually square and this grid won't be used for anything.
+                grid = MultiGrid((agent.view_size, agent.view_size), orientation=agent.dir+1)
+                vis_mask = np.zeros((agent.view_size, agent.view_size), dtype=np.bool)
+                ret[k] = grid, vis_mask
+
+        for (view_size, view_offset), ixs in groups.items():
+            views = self.grid.agent_views(
+                [agents[k].pos for k in ixs], [agents[k].dir for k in ixs], view_size, view_offset
+            )
+            # Process occluders and visibility for the whole group in one call.
+            vis_masks = occlude_masks(
+                ~self.grid.obj_reg.opaque[views], agents[ixs[0]].get_view_pos(),
+                [agents[k].see_through_walls for k in ixs]
+            )
+            for k, view, vis_mask in zip(ixs, views, vis_masks):
+                agent = agents[k]
+                grid = MultiGrid(
+                    view, obj_reg=self.grid.obj_reg, orientation=(self.grid.orientation - agent.dir - 1) % 4
+                )
+                self._hide_items(agent, grid)
+                ret[k] = grid, vis_mask
+        return ret
 
-        # Warning about the rest of the function:
+    def _hide_items(self, agent, grid):
+        # Warning about this function:
         #  Allows masking away objects that the agent isn't supposed to see.
         #  But breaks consistency between the states of the grid objects in the parial views
         #   and the grid objects overall.
@@ -447,15 +948,18 @@ class MultiGridEnv(gym.Env):
                         else:
                             grid.set(i,j,None)
 
-        return grid, vis_mask
-
-    def gen_agent_obs(self, agent):
+    def gen_agent_obs(self, agent, obs_grid=None):
         """
         Generate the agent's view (partially observable, low-resolution encoding)
         """
-        grid, vis_mask = self.gen_obs_grid(agent)
-        grid_image = grid.render(tile_size=agent.view_tile_size, visible_mask=vis_mask, top_agent=agent)
-        if agent.observation_style=='image':
+        grid, vis_mask = self.gen_obs_grid(agent) if obs_grid is None else obs_grid
+        if agent.observation_style == 'symbolic':
+            return self.gen_symbolic_obs(agent, grid, vis_mask)
+        grid_image = grid.render(
+            tile_size=agent.view_tile_size, visible_mask=vis_mask, top_agent=agent,
+            paletted=(agent.observation_style == 'palette')
+        )
+        if agent.observation_style in ('image', 'palette'):
             return grid_image
         else:
             ret = {'pov': grid_image}
@@ -469,42 +973,206 @@ class MultiGridEnv(gym.Env):
                 ret['orientation'] = agent_dir
             return ret
 
+    def gen_symbolic_obs(self, agent, grid, vis_mask):
+        """
+        Egocentric (view_size, view_size, 3) encoding of the agent's view: the
+        (type, color, state) of each visible cell as in MultiGrid.encode, zeros elsewhere.
+        Cells holding an agent (including ones stacked on another object) are encoded as
+        (agent type, agent color, 4 * agent index + direction), so agents can be told
+        apart and their headings are visible.
+        """
+        array = grid.encode(vis_mask=vis_mask)
+        if not agent.active:
+            return array
+
+        # Paint agent indices (+1, so 0 means no agent) into a grid-sized array and cut the
+        #  agent's view out of it the same way as in gen_obs_grid.
+        agent_ids = np.zeros((self.grid.width, self.grid.height), dtype=np.int64)
+        agent_ixs = {other: ix for ix, other in enumerate(self.agents)}
+        for (x, y), stack in self.agent_index.cells.items():
+            # The agent drawn on a cell is the one that got there first.
+            agent_ids[x, y] = agent_ixs[next(iter(stack))] + 1
+        topX, topY, _, _ = agent.get_view_exts()
+        view_ids = extract_view(
+            agent_ids, topX, topY, agent.view_size, agent.view_size, agent.dir + 1,
+            np.empty(vis_mask.shape, dtype=np.int64)
+        )
+        # Each agent always sees itself on its own cell.
+        view_ids[agent.get_view_pos()] = self.agents.index(agent) + 1
+        view_ids[~vis_mask] = 0
+
+        agent_cells = view_ids > 0
+        if agent_cells.any():
+            agent_table = np.array([
+                (*other.encode()[:2], 4 * ix + other.dir) for ix, other in enumerate(self.agents)
+            ], dtype="uint8")
+            array[agent_cells] = agent_table[view_ids[agent_cells] - 1]
+        return array
+
     def gen_obs(self):
-        return [self.gen_agent_obs(agent) for agent in self.agents]
+        perf = self.perf
+        if not perf:
+            obs_grids = self.gen_obs_grids()
+            obs = [self.gen_agent_obs(agent, obs_grid) for agent, obs_grid in zip(self.agents, obs_grids)]
+        else:
+            t = perf_counter_ns()
+            obs_grids = self.gen_obs_grids()
+            t = perf.lap('obs/grids', t)
+            obs = []
+            for ix, (agent, obs_grid) in enumerate(zip(self.agents, obs_grids)):
+                obs.append(self.gen_agent_obs(agent, obs_grid))
+                t = perf.lap(f'obs/agent_{ix}', t)
+        self._views = (self.grid, self.step_count, obs_grids, obs)
+        return obs
+
+    def current_views(self):
+        '''
+        (obs_grids, obs): each agent's (grid, vis_mask) view and observation of the env as it
+            is now. These are the ones the last step or reset computed, as long as the env
+            hasn't been stepped, reset or set_state'd since, so render (and recorders that
+            call it) don't redo the observation pass. Don't modify the returned arrays.
+        '''
+        views = self._views
+        if views is None or views[0] is not self.grid or views[1] != self.step_count:
+            self.gen_obs()
+            views = self._views
+        return views[2], views[3]
 
     def __str__(self):
         return self.grid.__str__()
 
     def check_agent_position_integrity(self, title=''):
         '''
-        This function checks whether each agent is present in the grid in exactly one place.
+        This function checks whether each agent is present in the grid in exactly one place:
+        that the agent index, the agents' positions and what the grid shows all agree.
         This is particularly helpful for validating the world state when ghost_mode=False and
-        agents can stack, since the logic for moving them around gets a bit messy.
-        Prints a message and drops into pdb if there's an inconsistency.
-        '''
-        agent_locs = [[] for _ in range(len(self.agents))]
-        for i in range(self.grid.width):
-            for j in range(self.grid.height):
-                x = self.grid.get(i,j)
-                for k,agent in enumerate(self.agents):
-                    if x==agent:
-                        agent_locs[k].append(('top', (i,j)))
-                    if hasattr(x, 'agents') and agent in x.agents:
-                        agent_locs[k].append(('stacked', (i,j)))
-        if not all([len(x)==1 for x in agent_locs]):
+        agents can stack. It only looks at the agents' own cells, so it's cheap enough to leave on.
+        Returns True if the state is consistent; otherwise prints the problems and returns False.
+        '''
+        problems = []
+        for agent in self.agents:
+            pos = self.agent_index.pos_of.get(agent)
+            if pos is None:
+                if agent.active:
+                    problems.append((agent.color, 'active but not on the grid'))
+                continue
+            if agent.pos is None or tuple(agent.pos) != pos:
+                problems.append((agent.color, f'at {agent.pos} but indexed at {pos}'))
+            cell = self.grid.get(*pos)
+            if not (cell is agent or (cell is not None and any(a is agent for a in cell.agents))):
+                problems.append((agent.color, f'indexed at {pos} but not shown there'))
+        if problems:
             print(f"{title} > Failed integrity test!")
-            for a, al in zip(self.agents, agent_locs):
-                print(" > ", a.color,'-', al)
-            import pdb; pdb.set_trace()
+            for problem in problems:
+                print(" > ", *problem)
+        return not problems
+
+    def _sync_cell(self, pos):
+        '''
+        Make the grid and the `agents` lists at pos match the agent index: the grid shows the
+            cell's object, or if there's none the agent that arrived first; the other agents
+            (in arrival order) go in the `agents` list of whatever the grid shows.
+        '''
+        stack = self.agent_index.agents_at(pos)
+        cell = self.grid.get(*pos)
+        if cell is not None and not cell.is_agent:
+            cell.agents = stack
+            return
+        for agent in stack:
+            agent.agents = []
+        top = stack[0] if stack else None
+        if top is not None:
+            top.agents = stack[1:]
+        if cell is not top:
+            self.grid.set(*pos, top)
+
+    def _move_forward(self, agent, agent_no, cur_pos, fwd_pos, fwd_cell, step_rewards):
+        # Move the agent in the index, then update what the old and new cells show
+        #  (agents it left behind take its place on the old cell).
+        self.agent_index.move(agent, fwd_pos)
+        self._sync_cell(cur_pos)
+        self._sync_cell(fwd_pos)
+        agent.pos = fwd_pos
+
+        # Rewards can be got iff. fwd_cell has a "get_reward" method
+        if hasattr(fwd_cell, 'get_reward'):
+            rwd = fwd_cell.get_reward(agent)
+            if bool(self.reward_decay):
+                rwd *= (1.0-0.9*(self.step_count/self.max_steps))
+            step_rewards[agent_no] += rwd
+            agent.reward(rwd)
+
+        if isinstance(fwd_cell, (Lava, Goal)):
+            agent.done = True
+
+    def _end_action(self, agent, stepped_on):
+        # Turn off berry flashing if it's time.
+        if isinstance(agent.carrying, PoisonedBerry):
+            if agent.carrying.time_since_pickup > 0:
+                agent.carrying.time_since_pickup -= 1
+            elif agent.carrying.time_since_pickup ==0:
+                agent.carrying.time_since_pickup = -1
+                agent.color = agent.carrying.good_color
+        agent.on_step(stepped_on)
+
+    def _step_compiled(self, iter_order, actions, step_rewards):
+        '''
+        The action loop of step, for steps where every action is left, right or forward:
+            turning and collisions run in the move_agents kernel, then the moves are applied
+            in the same order as the Python loop would (so the grid, the agent index and the
+            rewards come out the same).
+        Returns False, without changing anything, if the step needs the Python loop
+            (other actions, or agents that can't be walked onto).
+        '''
+        if not self.compiled_step:
+            return False
+        actions = np.asarray(actions)
+        if actions.dtype.kind not in 'iu' or not ((actions >= 0) & (actions <= 2)).all():
+            return False
+        agents = self.agents
+        if not all(agent.can_overlap() for agent in agents):
+            return False
+
+        active = np.array([agent.active for agent in agents], dtype=bool)
+        pos = np.array([agent.pos if agent.active else (0, 0) for agent in agents], dtype=np.int64).reshape(-1, 2)
+        dirs = np.array([agent.dir if agent.active else 0 for agent in agents], dtype=np.int64)
+        reg = self.grid.obj_reg
+        objects = np.where(reg.is_agent[self.grid.grid], 0, self.grid.grid)
+        counts = np.zeros(objects.shape, dtype=np.int64)
+        cells = self.agent_index.cells
+        if cells:
+            counts[tuple(np.array(list(cells)).T)] = [len(stack) for stack in cells.values()]
+        moved = np.zeros(len(agents), dtype=bool)
+        if not move_agents(iter_order, actions, active, pos, dirs, objects, counts, reg.overlappable, self.ghost_mode is not False, moved):
+            return False
+
+        actions, dirs, moved = actions.tolist(), dirs.tolist(), moved.tolist()
+        for k in iter_order.tolist():
+            agent = agents[k]
+            agent.step_reward = 0
+            if not agent.active:
+                continue
+            stepped_on = None
+            if actions[k] != 2:
+                agent.dir = dirs[k]
+            elif moved[k]:
+                fwd_pos = pos[k].copy()
+                stepped_on = reg.key_to_obj_map[self.grid.grid[fwd_pos[0], fwd_pos[1]]]
+                self._move_forward(agent, k, agent.pos, fwd_pos, stepped_on, step_rewards)
+            self._end_action(agent, stepped_on)
+        return True
 
     def step(self, actions):
-        
+        perf = self.perf
+        if perf: t0 = t = perf_counter_ns()
+
         for agent in self.agents:
             # Spawn agents if it's time.
             if not agent.active and not agent.done and self.step_count >= agent.spawn_delay:
                 self.place_obj(agent, **self.agent_spawn_kwargs)
                 agent.activate()
-                
+        if perf: t = perf.lap('step/spawn', t)
+
         assert len(actions) == len(self.agents)
 
         step_rewards = np.zeros((len(self.agents,)), dtype=np.float)
@@ -514,156 +1182,111 @@ class MultiGridEnv(gym.Env):
         iter_agents = list(enumerate(zip(self.agents, actions)))
         iter_order = np.arange(len(iter_agents))
         self.np_random.shuffle(iter_order)
-        for shuffled_ix in iter_order:
-            agent_no, (agent, action) = iter_agents[shuffled_ix]
-            agent.step_reward = 0
-
-            if agent.active:
-
-                cur_pos = agent.pos[:]
-                cur_cell = self.grid.get(*cur_pos)
-                fwd_pos = agent.front_pos[:]
-                fwd_cell = self.grid.get(*fwd_pos)
-                agent_moved = False
-
-                # Rotate left
-                if action == agent.actions.left:
-                    agent.dir = (agent.dir - 1) % 4
-
-                # Rotate right
-                elif action == agent.actions.right:
-                    agent.dir = (agent.dir + 1) % 4
-
-                # Move forward
-                elif action == agent.actions.forward:
-                    # Under the follow conditions, the agent can move forward.
-                    can_move = fwd_cell is None or fwd_cell.can_overlap()
-                    if self.ghost_mode is False and isinstance(fwd_cell, GridAgent):
-                        can_move = False
-
-                    if can_move:
-                        agent_moved = True
-                        # Add agent to new cell
-                        if fwd_cell is None:
-                            self.grid.set(*fwd_pos, agent)
-                            agent.pos = fwd_pos
+        if not self._step_compiled(iter_order, actions, step_rewards):
+            for shuffled_ix in iter_order:
+                agent_no, (agent, action) = iter_agents[shuffled_ix]
+                agent.step_reward = 0
+
+                if agent.active:
+
+                    cur_pos = agent.pos[:]
+                    fwd_pos = agent.front_pos[:]
+                    fwd_key = self.grid.grid[fwd_pos[0], fwd_pos[1]]
+                    fwd_cell = self.grid.obj_reg.key_to_obj_map[fwd_key]
+                    agent_moved = False
+
+                    # Rotate left
+                    if action == agent.actions.left:
+                        agent.dir = (agent.dir - 1) % 4
+
+                    # Rotate right
+                    elif action == agent.actions.right:
+                        agent.dir = (agent.dir + 1) % 4
+
+                    # Move forward
+                    elif action == agent.actions.forward:
+                        # Under the follow conditions, the agent can move forward.
+                        can_move = self.grid.obj_reg.overlappable[fwd_key]
+                        if self.ghost_mode is False and self.grid.obj_reg.is_agent[fwd_key]:
+                            can_move = False
+
+                        if can_move:
+                            agent_moved = True
+                            self._move_forward(agent, agent_no, cur_pos, fwd_pos, fwd_cell, step_rewards)
+
+                    # TODO: verify pickup/drop/toggle logic in an environment that 
+                    #  supports the relevant interactions.
+                    # Pick up an object
+                    elif action == agent.actions.pickup:
+                        if fwd_cell and fwd_cell.can_pickup():
+                            if agent.carrying is None:
+                                agent.carrying = fwd_cell
+                                agent.carrying.cur_pos = np.array([-1, -1])
+                                self.grid.set(*fwd_pos, None)
+                                self._sync_cell(fwd_pos)
+                                if isinstance(agent.carrying, PoisonedBerry):
+                                    agent.color=agent.carrying.bad_color
+                                    agent.carrying.time_since_pickup = self.FLASHING_TIME_POISONED_BERRIES
                         else:
-                            fwd_cell.agents.append(agent)
-                            agent.pos = fwd_pos
-
-                        # Remove agent from old cell
-                        if cur_cell == agent:
-                            self.grid.set(*cur_pos, None)
+                            pass
+
+                    # Drop an object
+                    elif action == agent.actions.drop:
+                        if not fwd_cell and agent.carrying:
+                            self.grid.set(*fwd_pos, agent.carrying)
+                            agent.carrying.cur_pos = fwd_pos
+                            agent.carrying = None
                         else:
-                            assert cur_cell.can_overlap()
-                            cur_cell.agents.remove(agent)
-
-                        # Add agent's agents to old cell
-                        for left_behind in agent.agents:
-                            cur_obj = self.grid.get(*cur_pos)
-                            if cur_obj is None:
-                                self.grid.set(*cur_pos, left_behind)
-                            elif cur_obj.can_overlap():
-                                cur_obj.agents.append(left_behind)
-                            else: # How was "agent" there in teh first place?
-                                raise ValueError("?!?!?!")
-
-                        # After moving, the agent shouldn't contain any other agents.
-                        agent.agents = [] 
-                        # test_integrity(f"After moving {agent.color} fellow")
-
-                        # Rewards can be got iff. fwd_cell has a "get_reward" method
-                        if hasattr(fwd_cell, 'get_reward'):
-                            rwd = fwd_cell.get_reward(agent)
-                            if bool(self.reward_decay):
-                                rwd *= (1.0-0.9*(self.step_count/self.max_steps))
-                            step_rewards[agent_no] += rwd
-                            agent.reward(rwd)
-                            
-
-                        if isinstance(fwd_cell, (Lava, Goal)):
-                            agent.done = True
-
-                # TODO: verify pickup/drop/toggle logic in an environment that 
-                #  supports the relevant interactions.
-                # Pick up an object
-                elif action == agent.actions.pickup:
-                    if fwd_cell and fwd_cell.can_pickup():
-                        if agent.carrying is None:
-                            agent.carrying = fwd_cell
-                            agent.carrying.cur_pos = np.array([-1, -1])
-                            self.grid.set(*fwd_pos, None)
-                            if isinstance(agent.carrying, PoisonedBerry):
-                                agent.color=agent.carrying.bad_color
-                                agent.carrying.time_since_pickup = self.FLASHING_TIME_POISONED_BERRIES
-                    else:
-                        pass
-
-                # Drop an object
-                elif action == agent.actions.drop:
-                    if not fwd_cell and agent.carrying:
-                        self.grid.set(*fwd_pos, agent.carrying)
-                        agent.carrying.cur_pos = fwd_pos
-                        agent.carrying = None
-                    else:
-                        pass
-
-                # Toggle/activate an object
-                elif action == agent.actions.toggle:
-                    if fwd_cell:
-                        wasted = bool(fwd_cell.toggle(agent, fwd_pos))
-                    else:
-                        pass
+                            pass
+
+                    # Toggle/activate an object
+                    elif action == agent.actions.toggle:
+                        if fwd_cell:
+                            wasted = bool(fwd_cell.toggle(agent, fwd_pos))
+                            # Toggling can change whether the object can be seen through/walked onto.
+                            self.grid.obj_reg.refresh(fwd_cell)
+                        else:
+                            pass
 
-                # Done action (not used by default)
-                elif action == agent.actions.done:
-                    agent.done = True
+                    # Done action (not used by default)
+                    elif action == agent.actions.done:
+                        agent.done = True
 
-                else:
-                    raise ValueError(f"Environment can't handle action {action}.")
-                  # Turn off berry flashing if it's time.
-                if isinstance(agent.carrying, PoisonedBerry):
-                    if agent.carrying.time_since_pickup > 0:
-                        agent.carrying.time_since_pickup -= 1
-                    elif agent.carrying.time_since_pickup ==0:
-                        agent.carrying.time_since_pickup = -1
-                        agent.color = agent.carrying.good_color
-                agent.on_step(fwd_cell if agent_moved else None)
+                    else:
+                        raise ValueError(f"Environment can't handle action {action}.")
+                    self._end_action(agent, fwd_cell if agent_moved else None)
+        if perf: t = perf.lap('step/actions', t)
 
-        
         # If any of the agents individually are "done" (hit lava or in some cases a goal) 
         #   but the env requires respawning, then respawn those agents.
         for agent in self.agents:
             if agent.done:
                 if self.respawn:
-                    resting_place_obj = self.grid.get(*agent.pos)
-                    if resting_place_obj == agent:
-                        if agent.agents:
-                            self.grid.set(*agent.pos, agent.agents[0])
-                            agent.agents[0].agents += agent.agents[1:]
-                        else:
-                            self.grid.set(*agent.pos, None)
-                    else:
-                        resting_place_obj.agents.remove(agent)
-                        resting_place_obj.agents += agent.agents[:]
-                        agent.agents = []
-                        
+                    resting_place = self.agent_index.remove(agent)
+                    self._sync_cell(resting_place)
+                    agent.agents = []
+
                     agent.reset(new_episode=False)
                     self.place_obj(agent, **self.agent_spawn_kwargs)
                     agent.activate()
                 else: # if the agent shouldn't be respawned, then deactivate it.
                     agent.deactivate()
+        if perf: t = perf.lap('step/respawn', t)
 
         # [ADDED: option for the environment to compute rewards of all agents at once (i.e. wait for everyone to finish)] 
         if (step_rewards_ := self.compute_rewards()) is not None: # only if compute_rewards is implemented
             step_rewards = np.copy(step_rewards_)
             for ix, agent in enumerate(self.agents):
                 agent.reward(step_rewards[ix])
+        if perf: t = perf.lap('step/compute_rewards', t)
 
         # The episode overall is done if all the agents are done, or if it exceeds the step limit.
         done = (self.step_count >= self.max_steps) or all([agent.done for agent in self.agents])
 
-        obs = [self.gen_agent_obs(agent) for agent in self.agents]
+        obs = self.gen_obs()
+        if perf:
+            perf.lap('step/obs', t)
+            perf.lap('step', t0)
 
         return obs, step_rewards, done, {}
     def compute_rewards(self):
@@ -686,7 +1309,11 @@ class MultiGridEnv(gym.Env):
 
         # If the target position is empty, then the object can always be placed.
         if grid_obj is None:
-            self.grid.set(*pos, obj)
+            if obj.is_agent:
+                self.agent_index.add(obj, pos)
+                self._sync_cell(pos)
+            else:
+                self.grid.set(*pos, obj)
             obj.set_position(pos)
             return True
 
@@ -696,31 +1323,83 @@ class MultiGridEnv(gym.Env):
 
         # If ghost mode is off and there's already an agent at the target cell, the agent can't
         #   be placed there.
-        if (not self.ghost_mode) and (grid_obj.is_agent or (len(grid_obj.agents)>0)):
+        if (not self.ghost_mode) and self.agent_index.occupied(pos):
             return False
 
-        grid_obj.agents.append(obj)
+        self.agent_index.add(obj, pos)
+        self._sync_cell(pos)
         obj.set_position(pos)
         return True
 
-    def place_obj(self, obj, top=(0,0), size=None, reject_fn=None, max_tries=1e5):
+    def placement_candidates(self, obj, top=(0,0), bottom=None, reject_mask=None):
+        '''
+        Flat indices (i*height + j) of the cells in [top, bottom) where try_place_obj(obj, ...)
+            would succeed and reject_mask (a (width, height) bool array, if given) isn't set.
+        '''
+        keys = self.grid.grid
+        ok = keys == 0
+        if obj.is_agent:
+            ok |= self.grid.obj_reg.overlappable[keys]
+            if not self.ghost_mode:
+                for (x, y) in self.agent_index.cells:
+                    ok[x, y] = False
+        if bottom is None:
+            bottom = (self.grid.width, self.grid.height)
+        region = np.zeros_like(ok)
+        region[top[0]:bottom[0], top[1]:bottom[1]] = True
+        ok &= region
+        if reject_mask is not None:
+            ok &= ~reject_mask
+        return np.flatnonzero(ok)
+
+    def place_obj(self, obj, top=(0,0), size=None, reject_fn=None, max_tries=1e5, reject_mask=None):
+        '''
+        Place obj at a uniformly random cell of the region [top, top+size) where
+            try_place_obj can put it, and return the position.
+        Rather than drawing random positions until one works, this samples directly from the
+            cells that are free (for objects: empty; for agents: empty or overlappable, and
+            unoccupied unless ghost_mode is on). Objects placed anywhere on the grid are drawn
+            in O(1) from the grid's list of empty cells.
+        Cells can be excluded with a vectorized reject_mask, or with reject_fn(pos), which is
+            called on candidates in random order until one is accepted, at most max_tries
+            times. Raises RecursionError if no cell is available, or if reject_fn rejected
+            max_tries of them.
+        '''
         max_tries = int(max(1, min(max_tries, 1e5)))
         top = (max(top[0], 0), max(top[1], 0))
         if size is None:
             size = (self.grid.width, self.grid.height)
         bottom = (min(top[0] + size[0], self.grid.width), min(top[1] + size[1], self.grid.height))
 
-        # agent_positions = [tuple(agent.pos) if agent.pos is not None else None for agent in self.agents]
-        for try_no in range(max_tries):
-            pos = self.np_random.integers(top, bottom)
-            if (reject_fn is not None) and reject_fn(pos):
-                continue
-            else:
-                if self.try_place_obj(obj, pos):
-                    break
+        whole_grid = top == (0, 0) and bottom == (self.grid.width, self.grid.height)
+        if whole_grid and not obj.is_agent and reject_mask is None and self.grid.owns_registry:
+            candidates = self.grid.free_cells
         else:
-            raise RecursionError("Rejection sampling failed in place_obj.")
+            candidates = self.placement_candidates(obj, top, bottom, reject_mask)
 
+        n = len(candidates)
+        if reject_fn is None:
+            if n > 0:
+                f = candidates[self.np_random.integers(0, n)]
+                pos = np.array(divmod(int(f), self.grid.height))
+        else:
+            # Sample without replacement (a lazy Fisher-Yates shuffle) until reject_fn accepts.
+            candidates = list(candidates)
+            for k in range(min(n, max_tries)):
+                swap = self.np_random.integers(k, n)
+                candidates[k], candidates[swap] = candidates[swap], candidates[k]
+                pos = np.array(divmod(int(candidates[k]), self.grid.height))
+                if not reject_fn(pos):
+                    break
+            else:
+                if n > max_tries:
+                    raise RecursionError(f"reject_fn rejected {max_tries} cells (max_tries) in place_obj.")
+                n = 0
+        if n == 0:
+            raise RecursionError("No free cell to place the object in (place_obj).")
+
+        placed = self.try_place_obj(obj, pos)
+        assert placed
         return pos
 
     def place_agents(self, top=None, size=None, rand_dir=True, max_tries=1000):
@@ -753,53 +1432,43 @@ class MultiGridEnv(gym.Env):
 
             self.window = SimpleImageViewer(caption="Marlgrid")
 
+        obs_grids, obs = self.current_views()
+
         # Compute which cells are visible to the agent
         highlight_mask = np.full((self.width, self.height), False, dtype=np.bool)
-        for agent in self.agents:
+        for agent, (_, vis_mask) in zip(self.agents, obs_grids):
             if agent.active:
-                xlow, ylow, xhigh, yhigh = agent.get_view_exts()
-                dxlow, dylow = max(0, 0-xlow), max(0, 0-ylow)
-                dxhigh, dyhigh = max(0, xhigh-self.grid.width), max(0, yhigh-self.grid.height)
-                if agent.see_through_walls:
-                    highlight_mask[xlow+dxlow:xhigh-dxhigh, ylow+dylow:yhigh-dyhigh] = True
-                else:
-                    a,b = self.gen_obs_grid(agent)
-                    highlight_mask[xlow+dxlow:xhigh-dxhigh, ylow+dylow:yhigh-dyhigh] |= (
-                        rotate_grid(b, a.orientation)[dxlow:(xhigh-xlow)-dxhigh, dylow:(yhigh-ylow)-dyhigh]
-                    )
+                offsets = view_offsets(agent.view_size, agent.view_offset)[agent.dir]
+                x = agent.pos[0] + offsets[0][vis_mask]
+                y = agent.pos[1] + offsets[1][vis_mask]
+                inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+                highlight_mask[x[inside], y[inside]] = True
 
 
         # Render the whole grid
         img = self.grid.render(
-            tile_size, highlight_mask=highlight_mask if highlight else None
-        )
-        rescale = lambda X, rescale_factor=2: np.kron(
-            X, np.ones((int(rescale_factor), int(rescale_factor), 1))
+            tile_size, highlight_mask=highlight_mask if highlight else None, incremental=True
         )
-
         if show_agent_views:
-
-            target_partial_width = int(img.shape[0]*agent_col_width_frac-2*agent_col_padding_px)
-            target_partial_height = (img.shape[1]-2*agent_col_padding_px)//max_agents_per_col
-
-            agent_views = [self.gen_agent_obs(agent) for agent in self.agents]
-            agent_views = [view['pov'] if isinstance(view, dict) else view for view in agent_views]
-            agent_views = [rescale(view, min(target_partial_width/view.shape[0], target_partial_height/view.shape[1])) for view in agent_views]
-            # import pdb; pdb.set_trace()
-            agent_views = [agent_views[pos:pos+max_agents_per_col] for pos in range(0, len(agent_views), max_agents_per_col)]
-
-            f_offset = lambda view: np.array([target_partial_height - view.shape[1], target_partial_width - view.shape[0]])//2
-            
-            cols = []
-            for col_views in agent_views:
-                col = np.full(( img.shape[0],target_partial_width+2*agent_col_padding_px,3), pad_grey, dtype=np.uint8)
-                for k, view in enumerate(col_views):
-                    offset = f_offset(view) + agent_col_padding_px
-                    offset[0] += k*target_partial_height
-                    col[offset[0]:offset[0]+view.shape[0], offset[1]:offset[1]+view.shape[1],:] = view
-                cols.append(col)
-
-            img = np.concatenate((img, *cols), axis=1)
+            agent_views = []
+            for agent, (grid, vis_mask), view in zip(self.agents, obs_grids, obs):
+                if agent.observation_style in ('image', 'rich'):
+                    agent_views.append(view['pov'] if isinstance(view, dict) else view)
+                else:
+                    # Symbolic and paletted observations aren't RGB images; draw the view they
+                    #  were made from instead.
+                    agent_views.append(
+                        grid.render(tile_size=agent.view_tile_size, visible_mask=vis_mask, top_agent=agent)
+                    )
+            if self._compositor is None:
+                self._compositor = Compositor()
+            img = self._compositor.compose(
+                img, agent_views,
+                max_views_per_col=max_agents_per_col,
+                col_width_frac=agent_col_width_frac,
+                col_padding_px=agent_col_padding_px,
+                pad_grey=pad_grey,
+            )
 
         if mode == "human":
             if not self.window.isopen:
@@ -0,0 +1,180 @@
+# Throughput benchmark over the registered environments.
+#   $ python -m marlgrid.bench --seconds 2 --n_agents 1 3 --observation_style image symbolic --output before.json
+#
+# Each registered env is rebuilt from the arguments it was registered with, overriding
+#  whichever of n_agents, grid_size, view_size, view_tile_size, observation_style and
+#  see_through_walls are given on the command line (every combination of the listed values
+#  is run). By default each env runs with its registered number of agents, 1 and 6 agents,
+#  and each observation style. Results are printed/written as JSON, one record per
+#  configuration.
+#
+# Each configuration runs in a fresh process, so that peak_rss_mb is its own peak memory
+#  use (start_rss_mb is the same process just before creating the env, i.e. the
+#  interpreter and imports). --in_process runs them all in this process instead, which is
+#  quicker to start but makes peak_rss_mb the running maximum over the configs so far.
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import numpy as np
+
+from .agents import GridAgentInterface
+from .envs import registered_env_specs
+
+COLORS = ["red", "blue", "purple", "orange", "olive", "pink"]
+
+
+def make_env(spec, n_agents, grid_size, view_size, view_tile_size, observation_style, see_through_walls, seed=0):
+    agents = [
+        GridAgentInterface(
+            color=COLORS[ix % len(COLORS)],
+            view_size=view_size,
+            view_tile_size=view_tile_size,
+            view_offset=spec['view_offset'],
+            observation_style=observation_style,
+            see_through_walls=see_through_walls,
+        )
+        for ix in range(n_agents)
+    ]
+    return spec['env_class'](agents=agents, grid_size=grid_size, seed=seed, **spec['env_kwargs'])
+
+
+def obs_nbytes(obs):
+    total = 0
+    for agent_obs in obs:
+        values = agent_obs.values() if isinstance(agent_obs, dict) else [agent_obs]
+        total += sum(np.asarray(v).nbytes for v in values)
+    return total
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def run(env, seconds, reset_seconds, seed=0, warmup_steps=20):
+    rng = np.random.default_rng(seed)
+    n_agents = len(env.agents)
+    n_actions = np.array([agent.action_space.n for agent in env.agents])
+
+    # Untimed, so that compiling the numba kernels and filling the tile caches isn't counted
+    #  against whichever configuration happens to run first.
+    env.reset()
+    for _ in range(warmup_steps):
+        _, _, done, _ = env.step(rng.integers(0, n_actions))
+        if done:
+            env.reset()
+
+    n_resets = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < reset_seconds:
+        env.reset()
+        n_resets += 1
+    reset_elapsed = time.perf_counter() - t0
+
+    env.reset()
+    n_steps = 0
+    n_bytes = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        obs, _, done, _ = env.step(rng.integers(0, n_actions))
+        n_bytes += obs_nbytes(obs)
+        n_steps += 1
+        if done:
+            env.reset()
+    elapsed = time.perf_counter() - t0
+
+    return {
+        'resets_per_sec': n_resets / reset_elapsed,
+        'steps_per_sec': n_steps / elapsed,
+        'agent_steps_per_sec': n_steps * n_agents / elapsed,
+        'obs_bytes_per_sec': n_bytes / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_config(env_name, config, seconds, reset_seconds, seed=0, warmup_steps=20):
+    start_rss_mb = peak_rss_mb()
+    env = make_env(registered_env_specs[env_name], **config, seed=seed)
+    record = run(env, seconds, reset_seconds, seed=seed, warmup_steps=warmup_steps)
+    env.close()
+    return {**record, 'start_rss_mb': start_rss_mb}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--envs', nargs='*', default=None, help="Registered env names (default: all).")
+    parser.add_argument('--n_agents', nargs='*', type=int, default=[None, 1, 6])
+    parser.add_argument('--grid_size', nargs='*', type=int, default=[None])
+    parser.add_argument('--view_size', nargs='*', type=int, default=[None])
+    parser.add_argument('--view_tile_size', nargs='*', type=int, default=[None])
+    parser.add_argument('--observation_style', nargs='*', default=['image', 'symbolic', 'palette'])
+    parser.add_argument('--see_through_walls', nargs='*', type=int, default=[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help="Stepping time per configuration.")
+    parser.add_argument('--reset_seconds', type=float, default=0.5, help="Resetting time per configuration.")
+    parser.add_argument('--warmup_steps', type=int, default=20, help="Untimed steps before timing each configuration.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--in_process', action='store_true', help="Run every configuration in this process.")
+    parser.add_argument('--output', default=None, help="Write the JSON here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    env_names = args.envs if args.envs else list(registered_env_specs)
+    run_args = (args.seconds, args.reset_seconds, args.seed, args.warmup_steps)
+    # spawn rather than fork, so that nothing the parent allocated counts towards a config.
+    mp = multiprocessing.get_context('spawn')
+    results = []
+    seen = set()
+    for env_name in env_names:
+        spec = registered_env_specs[env_name]
+        sweep = itertools.product(
+            args.n_agents, args.grid_size, args.view_size, args.view_tile_size,
+            args.observation_style, args.see_through_walls
+        )
+        for n_agents, grid_size, view_size, view_tile_size, observation_style, see_through_walls in sweep:
+            config = {
+                'env': env_name,
+                'n_agents': spec['n_agents'] if n_agents is None else n_agents,
+                'grid_size': spec['grid_size'] if grid_size is None else grid_size,
+                'view_size': spec['view_size'] if view_size is None else view_size,
+                'view_tile_size': spec['view_tile_size'] if view_tile_size is None else view_tile_size,
+                'observation_style': observation_style,
+                'see_through_walls': bool(see_through_walls),
+            }
+            # e.g. n_agents=None and n_agents=1 for an env registered with one agent.
+            if tuple(config.items()) in seen:
+                continue
+            seen.add(tuple(config.items()))
+            env_config = {k: v for k, v in config.items() if k != 'env'}
+            try:
+                if args.in_process:
+                    record = {**config, **run_config(env_name, env_config, *run_args)}
+                else:
+                    with mp.Pool(1) as pool:
+                        record = {**config, **pool.apply(run_config, (env_name, env_config, *run_args))}
+            except Exception as e:
+                record = {**config, 'error': f"{e.__class__.__name__}: {e}"}
+            print(json.dumps(record), file=sys.stderr)
+            results.append(record)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
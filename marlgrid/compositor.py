@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class Compositor:
+    '''
+    The canvas MultiGridEnv.render draws on: the grid image, with columns of agent views to
+        its right.
+
+    The canvas and its layout (where each view goes and by how much it's scaled up) are kept
+        between calls and only rebuilt when the sizes change. Views are upscaled by integer
+        factors (nearest neighbor) straight into the canvas.
+    '''
+    def __init__(self):
+        self.layout_key = None
+        self.canvas = None
+        self.slots = []
+
+    def _layout(self, grid_shape, view_shapes, max_views_per_col, col_width_frac, col_padding_px, pad_grey):
+        rows, cols = grid_shape[:2]
+        # Both dimensions of a view's slot are derived from the grid image as in the original
+        #  render code (width from the rows, height from the columns).
+        slot_w = int(rows*col_width_frac - 2*col_padding_px)
+        slot_h = (cols - 2*col_padding_px)//max_views_per_col
+        n_cols = -(-len(view_shapes)//max_views_per_col)
+        col_w = slot_w + 2*col_padding_px
+
+        self.canvas = np.full((rows, cols + n_cols*col_w, 3), pad_grey, dtype=np.uint8)
+        self.slots = []
+        for ix, (h, w) in enumerate(view_shapes):
+            col, k = divmod(ix, max_views_per_col)
+            scale = int(min(slot_w/h, slot_h/w))
+            top = (slot_h - w*scale)//2 + col_padding_px + k*slot_h
+            left = (slot_w - h*scale)//2 + col_padding_px + cols + col*col_w
+            self.slots.append((top, left, scale))
+
+    def compose(self, grid_img, views=(), max_views_per_col=3, col_width_frac=0.3, col_padding_px=2, pad_grey=100):
+        '''
+        Draw grid_img and the (h, w, 3) views onto the canvas and return a copy of it.
+        '''
+        view_shapes = tuple(view.shape[:2] for view in views)
+        key = (grid_img.shape, view_shapes, max_views_per_col, col_width_frac, col_padding_px, pad_grey)
+        if key != self.layout_key:
+            self._layout(grid_img.shape, view_shapes, max_views_per_col, col_width_frac, col_padding_px, pad_grey)
+            self.layout_key = key
+
+        canvas = self.canvas
+        canvas[:, :grid_img.shape[1]] = grid_img
+        for view, (top, left, scale) in zip(views, self.slots):
+            if scale == 0:
+                continue
+            h, w = view.shape[:2]
+            block = canvas[top:top + h*scale, left:left + w*scale]
+            # A view of the canvas, split into (h, scale, w, scale) pixel blocks.
+            block.shape = (h, scale, w, scale, 3)
+            block[...] = view[:, None, :, None]
+        return canvas.copy()
@@ -2,7 +2,7 @@ from ..base import MultiGridEnv
 
 from .empty import EmptyMultiGrid
 from .doorkey import DoorKeyEnv
-from .berries import SocialRejection
+from .berries import SocialRejection, SocialRejectionConfig
 from .cluttered import ClutteredMultiGrid
 from .goalcycle import ClutteredGoalCycleEnv
 from .viz_test import VisibilityTestEnv
@@ -16,6 +16,8 @@ import random
 
 this_module = sys.modules[__name__]
 registered_envs = []
+# env_name -> the arguments it was registered with (used by marlgrid.bench).
+registered_env_specs = {}
 
 
 def register_marl_env(
@@ -40,7 +42,7 @@ def register_marl_env(
                     GridAgentInterface(
                         color=c if agent_color is None else agent_color,
                         view_size=view_size,
-                        view_tile_size=8,
+                        view_tile_size=view_tile_size,
                         view_offset=view_offset,
                         )
                     for c in colors[:n_agents]
@@ -50,6 +52,15 @@ def register_marl_env(
             )
             return instance
 
+    registered_env_specs[env_name] = dict(
+        env_class=env_class,
+        n_agents=n_agents,
+        grid_size=grid_size,
+        view_size=view_size,
+        view_tile_size=view_tile_size,
+        view_offset=view_offset,
+        env_kwargs=env_kwargs,
+    )
     env_class_name = f"env_{len(registered_envs)}"
     setattr(this_module, env_class_name, RegEnv)
     registered_envs.append(env_name)
@@ -127,5 +138,5 @@ register_marl_env(
     n_agents=1,
     grid_size=15,
     view_size=5,
-    env_kwargs={'n_clutter':30}
+    env_kwargs={'config': SocialRejectionConfig(n_clutter=30)}
 )
\ No newline at end of file
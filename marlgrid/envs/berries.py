@@ -1,10 +1,39 @@
 from ..base import MultiGridEnv, MultiGrid
 from ..objects import *
 
+import copy
 import gym
 from textworld.gym.spaces.text_spaces import Char
 import string
 
+class SocialRejectionConfig:
+    '''
+    Settings of SocialRejection. Keyword arguments override the defaults below.
+    '''
+    def __init__(self, **kwargs):
+        self.width = 15
+        self.height = 15
+        self.max_steps = 100
+        self.reward_decay = False
+        self.FLASHING_TIME_POISONED_BERRIES = 5
+        self.n_clutter = None
+        self.clutter_density = 0.1
+        self.agent_color_space = None
+        self.n_good_berries = 5
+        self.n_bad_berries = 5
+        self.good_berry_reward = 1
+        self.poisoned_berry_reward = -1
+        self.update(**kwargs)
+
+    def update(self, **kwargs):
+        for k, v in kwargs.items():
+            if k == 'n_clutter':
+                self.clutter_density = None
+            elif k == 'clutter_density':
+                self.n_clutter = None
+            setattr(self, k, v)
+
+
 class SocialRejection(MultiGridEnv):
     mission = "Forage the berries before dark, don't let the poison in the refuge"
     metadata = {}
@@ -12,14 +41,19 @@ class SocialRejection(MultiGridEnv):
     def __init__(
             self,
             *args, 
-            config,
+            config=None,
+            grid_size=None,
             **kwargs):
+        config = SocialRejectionConfig() if config is None else copy.copy(config)
+        # Keyword arguments that name a setting of the config (e.g. max_steps) override it.
+        config.update(**{k: kwargs.pop(k) for k in list(kwargs) if k in vars(config)})
         if (config.n_clutter is None) == (config.clutter_density is None):
             raise ValueError("Must provide n_clutter xor clutter_density in environment config.")
 
+        # grid_size (e.g. from the env registry) overrides the config's width and height.
         super().__init__(*args, \
-                         width=config.width, \
-                         height=config.height,\
+                         width=config.width if grid_size is None else grid_size, \
+                         height=config.height if grid_size is None else grid_size,\
                          reward_decay=config.reward_decay,\
                          FLASHING_TIME_POISONED_BERRIES=config.FLASHING_TIME_POISONED_BERRIES,\
                          max_steps=config.max_steps, **kwargs)
@@ -67,18 +101,24 @@ class SocialRejection(MultiGridEnv):
 
     def _is_in_safe_zone(self, pose):
         return (pose[0] <= getattr(self, 'wall_x_pos', 0))
+
+    def _safe_zone_mask(self):
+        mask = np.zeros((self.width, self.height), dtype=bool)
+        mask[:getattr(self, 'wall_x_pos', 0)+1] = True
+        return mask
     def _gen_grid(self, width, height):
         self.grid = MultiGrid((width, height))
         self.grid.wall_rect(0, 0, width, height)
         
+        safe_zone = self._safe_zone_mask()
         for _ in range(getattr(self, 'n_clutter', 0)):
-            self.place_obj(Wall(), reject_fn=self._is_in_safe_zone, max_tries=100)
+            self.place_obj(Wall(), reject_mask=safe_zone)
             
         for _ in range(getattr(self, 'n_good_berries', 0)):
-            self.place_obj(Berry(), reject_fn=self._is_in_safe_zone, max_tries=100)
+            self.place_obj(Berry(), reject_mask=safe_zone)
             
         for _ in range(getattr(self, 'n_bad_berries', 0)):
-            self.place_obj(PoisonedBerry(), reject_fn=self._is_in_safe_zone, max_tries=100)
+            self.place_obj(PoisonedBerry(), reject_mask=safe_zone)
         
         for iy in range(self.height):
             if iy not in [self.height//2, self.height//2+1]:
@@ -0,0 +1,96 @@
+# Numba kernels for the per-step hot paths.
+# They're compiled with nogil=True, so several environments can run them at once
+#  from a thread pool (see marlgrid.vector.threaded).
+
+import numba
+import numpy as np
+
+
+@numba.njit(nogil=True, cache=True)
+def extract_view(grid, top_x, top_y, width, height, rot_k, out):
+    '''
+    Copy the (width, height) window of grid whose corner is at (top_x, top_y) into out,
+        rotated like rotate_grid(window, rot_k). Cells outside the grid are set to 0.
+    This is MultiGrid.slice, but writing a contiguous array in a single pass.
+    '''
+    grid_w, grid_h = grid.shape
+    rot_k = rot_k % 4
+    out_w, out_h = out.shape
+    for i in range(out_w):
+        for j in range(out_h):
+            if rot_k == 0:
+                sx, sy = i, j
+            elif rot_k == 1:
+                sx, sy = width - 1 - j, i
+            elif rot_k == 2:
+                sx, sy = width - 1 - i, height - 1 - j
+            else:
+                sx, sy = j, height - 1 - i
+            x = top_x + sx
+            y = top_y + sy
+            if 0 <= x < grid_w and 0 <= y < grid_h:
+                out[i, j] = grid[x, y]
+            else:
+                out[i, j] = 0
+    return out
+
+
+@numba.njit(nogil=True, cache=True)
+def gather_views(grid, pos, offsets, out):
+    '''
+    Copy several agents' view windows out of grid in one pass: out[k, i, j] is the cell at
+        pos[k] + offsets[k, :, i, j], or 0 where that falls outside the grid (as if the grid
+        were padded with empty cells).
+    '''
+    grid_w, grid_h = grid.shape
+    n, out_w, out_h = out.shape
+    for k in range(n):
+        for i in range(out_w):
+            for j in range(out_h):
+                x = pos[k, 0] + offsets[k, 0, i, j]
+                y = pos[k, 1] + offsets[k, 1, i, j]
+                if 0 <= x < grid_w and 0 <= y < grid_h:
+                    out[k, i, j] = grid[x, y]
+                else:
+                    out[k, i, j] = 0
+    return out
+
+
+@numba.njit(nogil=True, cache=True)
+def move_agents(order, actions, active, pos, dirs, objects, counts, overlappable, ghost_mode, moved):
+    '''
+    The turning and moving part of MultiGridEnv.step, for steps where every action is
+        left (0), right (1) or forward (2). Agents act in `order`; pos, dirs and counts are
+        updated in place and moved[k] is set if agent k stepped forward.
+    objects holds the key of the (non-agent) object on each cell or 0, and counts the
+        number of agents on each cell. Moving onto a cell with an object depends on the
+        object; otherwise agents can share cells unless ghost_mode is off.
+    Returns False if an agent would step off the grid, which step handles in Python.
+    '''
+    grid_w, grid_h = objects.shape
+    for k in order:
+        if not active[k]:
+            continue
+        action = actions[k]
+        if action == 0:
+            dirs[k] = (dirs[k] - 1) % 4
+        elif action == 1:
+            dirs[k] = (dirs[k] + 1) % 4
+        elif action == 2:
+            d = dirs[k]
+            x = pos[k, 0] + (1 if d == 0 else -1 if d == 2 else 0)
+            y = pos[k, 1] + (1 if d == 1 else -1 if d == 3 else 0)
+            if not (0 <= x < grid_w and 0 <= y < grid_h):
+                return False
+            key = objects[x, y]
+            if key != 0:
+                can_move = overlappable[key]
+            else:
+                can_move = ghost_mode or counts[x, y] == 0
+            if can_move:
+                counts[pos[k, 0], pos[k, 1]] -= 1
+                counts[x, y] += 1
+                pos[k, 0] = x
+                pos[k, 1] = y
+                moved[k] = True
+    return True
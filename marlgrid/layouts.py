@@ -0,0 +1,121 @@
+import copy
+import threading
+import numpy as np
+
+from .occupancy import AgentIndex
+
+
+def _snapshot(attrs):
+    # Each attribute with a shallow copy of its contents if it's a container, to detect
+    #  rebinding as well as in-place changes.
+    return {k: (v, copy.copy(v) if isinstance(v, (list, dict, set)) else None) for k, v in attrs.items()}
+
+
+class LayoutPool:
+    '''
+    A pool of `size` pre-generated layouts (the grids built by an env's _gen_grid), so that
+        resets can restore one with an array copy instead of generating a new grid.
+
+    Each layout is stored compactly as a key array plus the prototype of each object in it;
+        restoring copies the array and makes fresh copies of the objects, so state changed
+        during an episode (doors, bonus tiles) doesn't leak into later ones.
+
+    Layout k is generated from its own RNG, seeded from (seed, k), on a shallow copy of the env.
+        Its contents therefore don't depend on when or in which thread it was generated, and
+        with background=True the pool is filled by a daemon thread while the env runs (layouts
+        that aren't ready yet are generated on demand). Which layout a reset restores is drawn
+        from the env's own RNG, so seeded runs are reproducible.
+
+    Envs whose _gen_grid does more than build self.grid and self.agent_spawn_kwargs (e.g.
+        placing agents, or storing other per-episode attributes) can't use a pool: generating
+        a layout raises a ValueError if _gen_grid changed anything else. The first layout is
+        generated when the pool is created, so this shows up right away.
+    Pools can be shared by envs of the same class and config.
+    '''
+    # Attributes _gen_grid may set.
+    layout_attrs = ('grid', 'agent_spawn_kwargs')
+
+    def __init__(self, env, size=64, seed=0, background=False):
+        self.size = size
+        self.seed = seed
+        self.layouts = [None] * size
+        self.lock = threading.Lock()
+        self._template = copy.copy(env)
+        self.thread = None
+        self.get(0)
+        if background:
+            self.thread = threading.Thread(target=self._fill, daemon=True)
+            self.thread.start()
+
+    def __getstate__(self):
+        # Pickled pools keep the layouts generated so far; the rest are generated on demand.
+        state = dict(self.__dict__)
+        del state['lock']
+        state['thread'] = None
+        with self.lock:
+            state['layouts'] = list(self.layouts)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _fill(self):
+        for k in range(self.size):
+            self.get(k)
+
+    def _generate(self, k):
+        env = copy.copy(self._template)
+        env.np_random = np.random.Generator(np.random.PCG64(np.random.SeedSequence([self.seed, k])))
+        # An agent list and index of its own, so that a _gen_grid that adds or places agents
+        #  doesn't change the live env's (and is caught below).
+        env.agents = list(env.agents)
+        env.agent_index = AgentIndex()
+        before = _snapshot(vars(env))
+        env._gen_grid(env.width, env.height)
+        self._check_generated(env, before)
+
+        grid = env.grid
+        used = np.union1d([0], grid.grid)
+        keys = np.searchsorted(used, grid.grid).astype(np.min_scalar_type(len(used) - 1))
+        objects = [grid.obj_reg.key_to_obj_map[key] for key in used[1:]]
+        for obj in objects:
+            obj.agents = []
+        return keys, objects, env.agent_spawn_kwargs
+
+    def _check_generated(self, env, before):
+        after = vars(env)
+        missing = object()
+        changed = sorted(
+            k for k in set(before) | set(after)
+            if k not in self.layout_attrs and k != 'np_random' and (
+                k not in before or after.get(k, missing) is not before[k][0]
+                or (before[k][1] is not None and after[k] != before[k][1])
+            )
+        )
+        # (The agents themselves are shared with the live env, which may be moving them.)
+        placed_agents = len(env.agent_index) > 0 or env.grid.obj_reg.is_agent[env.grid.grid].any()
+        if changed or placed_agents:
+            raise ValueError(
+                f"{type(env).__name__}._gen_grid can't be used with a LayoutPool: it "
+                + (f"changed {', '.join(changed)}" if changed else "placed agents")
+                + f" (only {' and '.join(self.layout_attrs)} may be set)."
+            )
+
+    def get(self, k):
+        layout = self.layouts[k]
+        if layout is None:
+            layout = self._generate(k)
+            with self.lock:
+                if self.layouts[k] is None:
+                    self.layouts[k] = layout
+                layout = self.layouts[k]
+        return layout
+
+    def restore(self, env):
+        '''
+        Set env.grid (and env.agent_spawn_kwargs) to a copy of a random layout from the pool.
+        '''
+        keys, objects, spawn_kwargs = self.get(int(env.np_random.integers(0, self.size)))
+        env.grid = type(env.grid).from_layout(keys, [copy.copy(obj) for obj in objects])
+        env.agent_spawn_kwargs = dict(spawn_kwargs)
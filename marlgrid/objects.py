@@ -34,6 +34,7 @@ OBJECT_TYPES = []
 
 
 FLASHING_TIME_POISONED_BERRIES = 2
+
 class RegisteredObjectType(type):
     def __new__(meta, name, bases, class_dict):
         cls = type.__new__(meta, name, bases, class_dict)
@@ -48,6 +49,17 @@ class RegisteredObjectType(type):
 
 
 class WorldObj(metaclass=RegisteredObjectType):
+    '''
+    Object registries keep what see_behind, can_overlap and encode return for each object
+        (see base.ObjectRegistry). Changing the state or color of an object makes the
+        registries holding it recompute them for that object. Subclasses whose
+        see_behind/can_overlap/encode depend on other attributes must call self.changed()
+        after changing those.
+    '''
+    # The registries holding this object (a WeakSet, set by ObjectRegistry.track).
+    _registries = ()
+    is_agent = False
+
     def __init__(self, color="worst", state=0):
         self.color = color
         self.state = state
@@ -59,6 +71,36 @@ class WorldObj(metaclass=RegisteredObjectType):
         self.pos = None
         self.is_agent = False
 
+    def __getstate__(self):
+        # Registries add their objects back when they're unpickled.
+        state = dict(self.__dict__)
+        state.pop('_registries', None)
+        return state
+
+    def changed(self):
+        for reg in list(self._registries):
+            reg.refresh(self)
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        if self._registries:
+            self.changed()
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color):
+        self._color = color
+        if self._registries:
+            self.changed()
+
     @property
     def dir(self):
         return None
@@ -329,7 +371,8 @@ class Ball(WorldObj):
 
 
 class Door(WorldObj):
-    states = IntEnum("door_state", "open closed locked")
+    # module/qualname let pickle find the enum (and so pickle doors).
+    states = IntEnum("door_state", "open closed locked", module=__name__, qualname="Door.states")
 
     def can_overlap(self):
         return self.state == self.states.open# and self.agent is None  # is open
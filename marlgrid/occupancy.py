@@ -0,0 +1,59 @@
+class AgentIndex:
+    '''
+    Which agents are on each cell of the grid, in the order they arrived.
+
+    Adding, moving and removing an agent are O(1): each cell keeps an insertion-ordered dict
+        of its agents, and each agent's cell is kept in pos_of.
+
+    MultiGridEnv treats this as the source of truth for where agents are, and derives the
+        older representation from it (see MultiGridEnv._sync_cell): the grid shows the cell's
+        object if there is one, otherwise the agent that arrived first, and the others are
+        listed in the `agents` attribute of whatever the grid shows.
+    '''
+    def __init__(self):
+        self.cells = {}
+        self.pos_of = {}
+
+    @staticmethod
+    def _key(pos):
+        return (int(pos[0]), int(pos[1]))
+
+    def clear(self):
+        self.cells = {}
+        self.pos_of = {}
+
+    def add(self, agent, pos):
+        if agent in self.pos_of:
+            self.remove(agent)
+        pos = self._key(pos)
+        self.cells.setdefault(pos, {})[agent] = None
+        self.pos_of[agent] = pos
+
+    move = add
+
+    def remove(self, agent):
+        pos = self.pos_of.pop(agent, None)
+        if pos is not None:
+            stack = self.cells[pos]
+            del stack[agent]
+            if not stack:
+                del self.cells[pos]
+        return pos
+
+    def agents_at(self, pos):
+        return list(self.cells.get(self._key(pos), ()))
+
+    def top(self, pos):
+        '''
+        The agent drawn on the cell at pos (the first to arrive), or None.
+        '''
+        return next(iter(self.cells.get(self._key(pos), ())), None)
+
+    def occupied(self, pos):
+        return self._key(pos) in self.cells
+
+    def __contains__(self, agent):
+        return agent in self.pos_of
+
+    def __len__(self):
+        return len(self.pos_of)
@@ -0,0 +1,71 @@
+import itertools
+import numpy as np
+
+from .atlas import highlight
+from .objects import COLORS
+
+
+class Palette:
+    '''
+    Fixed table of RGB colors, so that rendered images can be stored as one uint8 palette
+        index per pixel instead of three channels.
+
+    The table is built up front and never changes, so an index means the same color in every
+        process and `colors` never has to be shipped alongside the indices. It holds black,
+        every color in COLORS and their highlighted versions (see MultiGridEnv.render), which
+        index() maps exactly, followed by a 6x6x6 cube of evenly spaced colors.
+
+    Every other color - anti-aliased edges, blends of agents over objects and the continuous
+        tints of agents with color='prestige' - maps to the nearest color of the cube, so it
+        comes back from decode() off by at most 25 per channel.
+    '''
+    levels = np.linspace(0, 255, 6).astype(np.uint8)
+
+    def __init__(self):
+        named = []
+        for color in [(0, 0, 0), *(tuple(int(c) for c in rgb) for rgb in COLORS.values())]:
+            if color not in named:
+                named.append(color)
+        named = np.array(named, dtype=np.uint8)
+        exact = []
+        for color in [*named, *highlight(named)]:
+            if tuple(color) not in exact:
+                exact.append(tuple(color))
+        cube = np.array(list(itertools.product(self.levels, repeat=3)), dtype=np.uint8)
+
+        self.colors = np.concatenate([np.array(exact, dtype=np.uint8), cube])
+        self.n_colors = len(self.colors)
+        self.cube_offset = len(exact)
+        assert self.n_colors <= 256
+
+        packed = self.pack(self.colors[:self.cube_offset])
+        order = np.argsort(packed)
+        self._exact_packed = packed[order]
+        self._exact_index = order.astype(np.uint8)
+
+    @staticmethod
+    def pack(rgb):
+        rgb = rgb.astype(np.uint32)
+        return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+    def index(self, img):
+        '''
+        Convert an (..., 3) RGB image into (...) uint8 palette indices.
+        '''
+        packed = self.pack(img)
+        pos = np.searchsorted(self._exact_packed, packed).clip(0, len(self._exact_packed) - 1)
+        # Round each channel to the nearest of the 6 levels (which are 51 apart).
+        q = (img.astype(np.uint16) + 25) // 51
+        cube_ix = self.cube_offset + (q[..., 0] * 36 + q[..., 1] * 6 + q[..., 2])
+        return np.where(self._exact_packed[pos] == packed, self._exact_index[pos], cube_ix).astype(np.uint8)
+
+    def decode(self, indices):
+        return decode_palette(indices, self.colors)
+
+
+def decode_palette(indices, colors):
+    '''
+    Map palette indices of any shape (e.g. a (batch, n_agents, H, W) stack from a replay
+        buffer) back to RGB, with a single gather.
+    '''
+    return np.take(colors, indices, axis=0)
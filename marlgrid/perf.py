@@ -0,0 +1,60 @@
+from time import perf_counter_ns
+import numpy as np
+
+
+class PerfStats:
+    '''
+    Rolling latency samples for named phases (e.g. the parts of MultiGridEnv.step).
+
+    Each phase keeps its last `window` durations in a ring buffer. Timing a sequence of
+        phases costs one perf_counter_ns call per phase:
+
+        t = perf_counter_ns()
+        ...
+        t = perf.lap('spawn', t)
+        ...
+        t = perf.lap('actions', t)
+
+    summary() reduces the buffers to counts, means and p50/p95/p99 percentiles.
+    '''
+    def __init__(self, window=10000):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, name, duration_ns):
+        buf = self.samples.get(name)
+        if buf is None:
+            buf = self.samples[name] = np.zeros(self.window, dtype=np.int64)
+            self.counts[name] = 0
+        buf[self.counts[name] % self.window] = duration_ns
+        self.counts[name] += 1
+
+    def lap(self, name, start_ns):
+        now = perf_counter_ns()
+        self.add(name, now - start_ns)
+        return now
+
+    def clear(self):
+        self.samples = {}
+        self.counts = {}
+
+    def summary(self):
+        '''
+        {phase: {'count', 'mean_us', 'p50_us', 'p95_us', 'p99_us', 'max_us'}} over the samples
+            in each phase's window ('count' is the total number of samples ever recorded).
+        '''
+        ret = {}
+        for name, buf in self.samples.items():
+            count = self.counts[name]
+            recent = buf[:min(count, self.window)] / 1e3
+            p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+            ret[name] = {
+                'count': count,
+                'mean_us': float(recent.mean()),
+                'p50_us': float(p50),
+                'p95_us': float(p95),
+                'p99_us': float(p99),
+                'max_us': float(recent.max()),
+            }
+        return ret
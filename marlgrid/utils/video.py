@@ -1,59 +1,487 @@
 import gym
 import numpy as np
 import os
+import pickle
+import shutil
+import struct
+import subprocess
+import warnings
+import zlib
+from fractions import Fraction
 import tqdm
 
+from ..base import _copy_attrs
 
-def export_video(X, outfile, fps=30, rescale_factor=2):
 
-    try:
-        import moviepy.editor as mpy
-    except:
-        raise ImportError(
-            "GridRecorder requires moviepy library. Try installing:\n $ pip install moviepy"
+def _ffmpeg_exe():
+    exe = shutil.which("ffmpeg")
+    if exe is None:
+        try:
+            import imageio_ffmpeg
+            exe = imageio_ffmpeg.get_ffmpeg_exe()
+        except Exception:
+            pass
+    return exe
+
+
+def _make_parent_dir(outfile):
+    outfile = os.path.abspath(os.path.expanduser(outfile))
+    if not os.path.isdir(os.path.dirname(outfile)):
+        os.makedirs(os.path.dirname(outfile))
+    return outfile
+
+
+class VideoWriter:
+    '''
+    Base class of the streaming video writers.
+
+    Frames are upscaled (nearest neighbor, by an integer rescale_factor) into a preallocated
+        uint8 buffer of chunk_size frames, which is handed to _write_chunk whenever it fills
+        up. Memory use therefore doesn't depend on the length of the video.
+
+    Writers are context managers; the file is only complete once close() has been called.
+    '''
+    def __init__(self, outfile, fps=30, rescale_factor=1, chunk_size=32):
+        self.outfile = _make_parent_dir(outfile)
+        self.fps = fps
+        self.rescale_factor = int(rescale_factor or 1)
+        self.chunk_size = chunk_size
+        self.buffer = None
+        self.n_buffered = 0
+        self.n_frames = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, frame):
+        frame = np.asarray(frame)
+        if frame.dtype != np.uint8:
+            if np.issubdtype(frame.dtype, np.floating) and frame.max() <= 1:
+                frame = frame * 255
+            frame = frame.clip(0, 255).astype(np.uint8)
+        h, w = frame.shape[:2]
+        s = self.rescale_factor
+        if self.buffer is None:
+            self.buffer = np.empty((self.chunk_size, h*s, w*s, 3), dtype=np.uint8)
+            self._open(h*s, w*s)
+        elif self.buffer.shape[1:3] != (h*s, w*s):
+            raise ValueError(
+                f"Frame of shape {frame.shape} doesn't match the previous frames "
+                f"({self.buffer.shape[1]//s}, {self.buffer.shape[2]//s})."
+            )
+        out = self.buffer[self.n_buffered]
+        if s == 1:
+            out[...] = frame
+        else:
+            out.reshape(h, s, w, s, 3)[...] = frame[:, None, :, None]
+        self.n_buffered += 1
+        self.n_frames += 1
+        if self.n_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered:
+            self._write_chunk(self.buffer[:self.n_buffered])
+            self.n_buffered = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self.buffer is not None:
+            self._close()
+        self.closed = True
+
+    def _open(self, height, width):
+        raise NotImplementedError
+
+    def _write_chunk(self, frames):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class FFmpegWriter(VideoWriter):
+    '''
+    Pipes raw RGB frames to an ffmpeg process, which encodes them in the format given by the
+        extension of outfile (e.g. .mp4, .webm).
+    '''
+    def _open(self, height, width):
+        exe = _ffmpeg_exe()
+        if exe is None:
+            raise RuntimeError("FFmpegWriter requires an ffmpeg binary on the PATH.")
+        self.proc = subprocess.Popen(
+            [
+                exe, "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps),
+                "-i", "-",
+                # Most codecs need even dimensions for yuv420p.
+                "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p",
+                self.outfile,
+            ],
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE,
         )
 
-    if isinstance(X, list):
-        X = np.stack(X)
+    def _write_chunk(self, frames):
+        self.proc.stdin.write(frames.data)
 
-    if isinstance(X, np.float) and X.max() < 1:
-        X = (X * 255).astype(np.uint8).clip(0, 255)
+    def _close(self):
+        _, err = self.proc.communicate()
+        if self.proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed writing {self.outfile}:\n{err.decode(errors='replace')}")
 
-    if rescale_factor is not None and rescale_factor != 1:
-        X = np.kron(X, np.ones((1, rescale_factor, rescale_factor, 1)))
 
-    def make_frame(i):
-        out = X[i]
-        return out
+class GifWriter(VideoWriter):
+    '''
+    Writes an animated GIF frame by frame with PIL, each frame with its own palette.
+    '''
+    def _open(self, height, width):
+        try:
+            from PIL import Image, GifImagePlugin
+        except ImportError:
+            raise ImportError(
+                "GifWriter requires PIL. Try installing:\n $ pip install Pillow"
+            )
+        self._image, self._gif = Image, GifImagePlugin
+        self.fp = open(self.outfile, "wb")
+        self.header_written = False
 
-    getframe = lambda t: make_frame(min(int(t * fps), len(X) - 1))
-    clip = mpy.VideoClip(getframe, duration=len(X) / fps)
+    def _write_chunk(self, frames):
+        for frame in frames:
+            im = self._image.fromarray(frame, "RGB").convert("P", palette=self._image.Palette.ADAPTIVE)
+            if not self.header_written:
+                header, _ = self._gif.getheader(im, info={"loop": 0})
+                self.fp.write(b"".join(header))
+                self.header_written = True
+            for data in self._gif.getdata(im, duration=1000/self.fps, include_color_table=True):
+                self.fp.write(data)
 
-    outfile = os.path.abspath(os.path.expanduser(outfile))
-    if not os.path.isdir(os.path.dirname(outfile)):
-        os.makedirs(os.path.dirname(outfile))
-    clip.write_videofile(outfile, fps=fps)
+    def _close(self):
+        self.fp.write(b";")
+        self.fp.close()
 
 
-def render_frames(X, path, ext="png"):
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+class ApngWriter(VideoWriter):
+    '''
+    Writes a lossless animated PNG frame by frame (needs only zlib).
+    '''
+    def _open(self, height, width):
+        self.fp = open(self.outfile, "wb")
+        self.fp.write(b"\x89PNG\r\n\x1a\n")
+        self.fp.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        # The frame count is filled in by close().
+        self.actl_offset = self.fp.tell()
+        self.fp.write(_png_chunk(b"acTL", struct.pack(">II", 0, 0)))
+        self.sequence = 0
+        delay = Fraction(self.fps).limit_denominator(1000)
+        self.delay = (delay.denominator, delay.numerator)
+        # Each row of PNG image data starts with its filter type (0: none).
+        self.rows = np.zeros((height, 1 + width*3), dtype=np.uint8)
+
+    def _write_chunk(self, frames):
+        height, width = frames.shape[1:3]
+        for frame in frames:
+            self.fp.write(_png_chunk(b"fcTL", struct.pack(
+                ">IIIIIHHBB", self.sequence, width, height, 0, 0, *self.delay, 0, 0
+            )))
+            self.sequence += 1
+            self.rows[:, 1:] = frame.reshape(height, -1)
+            data = zlib.compress(self.rows.data, 6)
+            if self.sequence == 1:
+                self.fp.write(_png_chunk(b"IDAT", data))
+            else:
+                self.fp.write(_png_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+                self.sequence += 1
+
+    def _close(self):
+        self.fp.write(_png_chunk(b"IEND", b""))
+        self.fp.seek(self.actl_offset)
+        self.fp.write(_png_chunk(b"acTL", struct.pack(">II", self.n_frames, 0)))
+        self.fp.close()
+
+
+class NpyWriter(VideoWriter):
+    '''
+    Writes the frames as a (n_frames, H, W, 3) uint8 .npy file, which can be read back
+        lazily with np.load(outfile, mmap_mode='r').
+    '''
+    header_len = 128
+
+    def _open(self, height, width):
+        self.fp = open(self.outfile, "wb")
+        self.frame_shape = (height, width, 3)
+        self._write_header(0)
+
+    def _write_header(self, n_frames):
+        header = repr({"descr": "|u1", "fortran_order": False, "shape": (n_frames, *self.frame_shape)})
+        header = header.encode("latin1").ljust(self.header_len - 11) + b"\n"
+        self.fp.write(np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header)
+
+    def _write_chunk(self, frames):
+        self.fp.write(frames.data)
+
+    def _close(self):
+        self.fp.seek(0)
+        self._write_header(self.n_frames)
+        self.fp.close()
+
+
+video_writers = {
+    ".gif": GifWriter,
+    ".png": ApngWriter,
+    ".apng": ApngWriter,
+    ".npy": NpyWriter,
+}
+
+
+def open_video_writer(outfile, fps=30, rescale_factor=1, chunk_size=32):
+    '''
+    Open the streaming writer for outfile's extension: .gif, .png/.apng, .npy, or anything
+        else for ffmpeg. Without an ffmpeg binary, other formats are written as a GIF (or an
+        .npy file if PIL isn't installed either) next to outfile, with a warning.
+    '''
+    base, ext = os.path.splitext(outfile)
+    writer = video_writers.get(ext.lower())
+    if writer is None:
+        if _ffmpeg_exe() is not None:
+            writer = FFmpegWriter
+        else:
+            try:
+                import PIL
+                ext = ".gif"
+            except ImportError:
+                ext = ".npy"
+            warnings.warn(f"No ffmpeg binary found; writing {base + ext} instead of {outfile}.")
+            outfile = base + ext
+            writer = video_writers[ext]
+    return writer(outfile, fps=fps, rescale_factor=rescale_factor, chunk_size=chunk_size)
+
+
+def export_video(X, outfile, fps=30, rescale_factor=2, chunk_size=32):
+    with open_video_writer(outfile, fps=fps, rescale_factor=rescale_factor, chunk_size=chunk_size) as writer:
+        for frame in X:
+            writer.append(frame)
+    return writer.outfile
+
+
+def _frames_dir(path):
+    # If the path has a file extension, dump frames in a new directory with = path minus extension
+    if "." in os.path.basename(path):
+        path = os.path.splitext(path)[0]
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def save_frame(frame, path, k, ext="png"):
     try:
         from PIL import Image
     except ImportError as e:
         raise ImportError(
             "Error importing from PIL in export_frames. Try installing PIL:\n $ pip install Pillow"
         )
+    Image.fromarray(frame, "RGB").save(os.path.join(path, f"frame_{k}.{ext}"))
 
-    # If the path has a file extension, dump frames in a new directory with = path minus extension
-    if "." in os.path.basename(path):
-        path = os.path.splitext(path)[0]
-    if not os.path.isdir(path):
-        os.makedirs(path)
 
-    for k, frame in tqdm.tqdm(enumerate(X), total=len(X)):
-        Image.fromarray(frame, "RGB").save(os.path.join(path, f"frame_{k}.{ext}"))
+def render_frames(X, path, ext="png"):
+    path = _frames_dir(path)
+    for k, frame in tqdm.tqdm(enumerate(X), total=len(X) if hasattr(X, '__len__') else None):
+        save_frame(frame, path, k, ext=ext)
+
+
+class EpisodeLog:
+    '''
+    Compact record of a MultiGridEnv episode, from which its frames can be rendered later, in
+        this or another process (the log can be pickled; see save/load and export_episode).
+
+    The env is pickled once, when the log is created. After that, each call to record(env)
+        only stores what changed since the previous one: the cells of the grid's key array
+        that now hold a different object, the (color, state) of objects whose encoding changed
+        (e.g. doors), each agent's position, direction, activity, color and prestige, and the
+        order agents are stacked in on shared cells. Objects are referred to by tokens, which
+        stay the same across steps even when the registry reuses keys; objects that first
+        appear mid-episode are stored as a copy of their attributes.
+    render() replays the records on a copy of the env and renders each state.
+    '''
+    def __init__(self, env):
+        objects = {}
+        for obj in env.grid.obj_reg.key_to_obj_map.values():
+            if obj is not None:
+                objects[id(obj)] = obj
+        for agent in env.agents:
+            objects[id(agent)] = agent
+            if agent.carrying is not None:
+                objects[id(agent.carrying)] = agent.carrying
+        objects = list(objects.values())
+        # Pickling the objects along with the env keeps their identity, so the tokens can
+        #  refer to the copies in the unpickled env.
+        self.initial = pickle.dumps((env, objects))
+        self.n_initial = len(objects)
+        self.new_objects = []
+        self.records = []
+
+        # Token 0 is the empty cell.
+        self._objects = [None, *objects]
+        self._tokens = {id(obj): k for k, obj in enumerate(self._objects)}
+        self._grid = env.grid.grid.copy()
+        self._encoding = env.grid.obj_reg.encoding.copy()
+
+    def __getstate__(self):
+        # The bookkeeping of record() refers to the live env's objects.
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    def __len__(self):
+        return len(self.records)
+
+    def _token(self, obj):
+        token = self._tokens.get(id(obj))
+        if token is None:
+            token = self._tokens[id(obj)] = len(self._objects)
+            self._objects.append(obj)
+            attrs = _copy_attrs(vars(obj))
+            attrs['agents'] = []
+            self.new_objects.append((type(obj), attrs))
+        return token
+
+    def record(self, env):
+        grid = env.grid.grid
+        reg = env.grid.obj_reg
+        key_to_obj = reg.key_to_obj_map
+
+        cells = np.flatnonzero(grid != self._grid)
+        cell_keys = grid.flat[cells].tolist()
+        cell_tokens = [self._token(key_to_obj[key]) for key in cell_keys]
+        if cell_keys:
+            self._grid = grid.copy()
+
+        # Objects that were just placed, or whose encoding changed (e.g. a door was toggled).
+        keys = set(cell_keys)
+        encoding = reg.encoding
+        if encoding.tobytes() != self._encoding.tobytes():
+            n = min(len(encoding), len(self._encoding))
+            keys.update(np.flatnonzero((encoding[:n] != self._encoding[:n]).any(1)).tolist())
+            keys.update(range(n, len(encoding)))
+            self._encoding = encoding.copy()
+        states = []
+        for key in keys:
+            obj = key_to_obj.get(key)
+            if obj is not None and not obj.is_agent:
+                states.append((self._token(obj), obj.color, obj.state))
+
+        agents = [
+            (
+                None if agent.pos is None else (int(agent.pos[0]), int(agent.pos[1])),
+                agent.state, agent.active, agent.color, agent.prestige,
+            )
+            for agent in env.agents
+        ]
+        agent_cells = [
+            (pos, [self._tokens[id(agent)] for agent in stack])
+            for pos, stack in env.agent_index.cells.items()
+        ]
+        self.records.append((
+            env.step_count, cells.astype(np.int32), cell_tokens, states, agents, agent_cells
+        ))
+
+    def replay(self):
+        '''
+        Yield a copy of the env set to each recorded state in turn.
+        '''
+        env, objects = pickle.loads(self.initial)
+        objects = [None, *objects]
+        for cls, attrs in self.new_objects:
+            obj = cls.__new__(cls)
+            obj.__dict__.update(_copy_attrs(attrs))
+            objects.append(obj)
+
+        for step_count, cells, cell_tokens, states, agents, agent_cells in self.records:
+            grid = env.grid
+            height = grid.height
+            for cell, token in zip(cells.tolist(), cell_tokens):
+                grid.set(cell // height, cell % height, objects[token])
+            for token, color, state in states:
+                obj = objects[token]
+                obj.color, obj.state = color, state
+            for agent, (pos, state, active, color, prestige) in zip(env.agents, agents):
+                agent.pos = pos
+                agent.state, agent.active, agent.color, agent.prestige = state, active, color, prestige
+
+            index = env.agent_index
+            touched = set(index.cells)
+            index.clear()
+            for pos, stack in agent_cells:
+                for token in stack:
+                    index.add(objects[token], pos)
+            touched.update(index.cells)
+            for pos in touched:
+                env._sync_cell(pos)
+
+            env.step_count = step_count
+            env._views = None
+            yield env
+
+    def render(self, **render_kwargs):
+        '''
+        Yield the frame env.render(mode="rgb_array", **render_kwargs) draws for each recorded
+            state.
+        '''
+        for env in self.replay():
+            yield env.render(mode="rgb_array", **render_kwargs)
+
+    def save(self, path):
+        with open(_make_parent_dir(path), "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(os.path.abspath(os.path.expanduser(path)), "rb") as f:
+            return pickle.load(f)
+
+
+def export_episode(log, outfile=None, frames_path=None, render_kwargs={}, video_kwargs={}):
+    '''
+    Render an EpisodeLog (or the path of a saved one) to a video and/or frame images.
+    A plain function of picklable arguments, so that it can be submitted to a process pool.
+    '''
+    if not isinstance(log, EpisodeLog):
+        log = EpisodeLog.load(log)
+    if outfile is not None:
+        outfile = export_video(log.render(**render_kwargs), outfile, **{'rescale_factor': 1, **video_kwargs})
+    if frames_path is not None:
+        render_frames(log.render(**render_kwargs), frames_path)
+    return outfile
 
 class GridRecorder(gym.core.Wrapper):
+    '''
+    Records rendered frames of the episodes selected by `recording` / `auto_save_interval`.
+
+    By default (stream=False) an episode's frames are kept in memory, so that they can be
+        exported at any point of the episode, and are exported when the next episode starts.
+        The buffer grows with the episode (doubling, up to max_steps frames), so memory use
+        is proportional to the length of the episode. Memory use only stays constant with
+        stream=True or record_states=True.
+    With stream=True, each frame is instead appended to the video (see open_video_writer;
+        video_kwargs can also set chunk_size) and saved as an image as soon as it's rendered.
+
+    With record_states=True (MultiGridEnvs only), nothing is rendered while the env runs: each
+        frame only adds the changes to the world state to an EpisodeLog, which reset saves as
+        states_{n}.pkl. Frames are rendered when an episode is exported: by
+        export_video/export_frames for the current (or last) episode, or by export_episode
+        for a saved log, e.g. in another process.
+    '''
     default_max_len = 1000
+    # Size of the first frame buffer with stream=False.
+    frame_chunk_size = 64
     default_video_kwargs = {
         'fps': 20,
         'rescale_factor': 1,
@@ -67,7 +495,10 @@ class GridRecorder(gym.core.Wrapper):
             auto_save_videos=True,
             auto_save_interval=None,
             render_kwargs={},
-            video_kwargs={}
+            video_kwargs={},
+            stream=False,
+            video_ext='.mp4',
+            record_states=False,
             ):
         super().__init__(env)
 
@@ -83,6 +514,14 @@ class GridRecorder(gym.core.Wrapper):
         self.render_kwargs = render_kwargs
         self.video_kwargs = {**self.default_video_kwargs, **video_kwargs}
         self.n_parallel = getattr(env, 'num_envs', 1)
+        self.stream = stream
+        self.video_ext = video_ext
+        self.writer = None
+        self.frames_path = None
+        self.record_states = record_states
+        self.episode_log = None
+        if record_states and not hasattr(env.unwrapped, 'agent_index'):
+            raise ValueError("record_states=True requires a MultiGridEnv.")
 
         if max_steps is None:
             if hasattr(env, "max_steps") and env.max_steps != 0:
@@ -104,32 +543,53 @@ class GridRecorder(gym.core.Wrapper):
             return False
         return (self.reset_count - self.last_save) >= self.auto_save_interval
 
+    def _episode_frames(self):
+        if self.record_states:
+            if self.episode_log is None:
+                raise RuntimeError("No episode has been recorded yet.")
+            return self.episode_log.render(**self.render_kwargs)
+        if self.stream:
+            raise RuntimeError(
+                "With stream=True, frames are written as they're recorded and aren't kept for export."
+            )
+        return self.frames[:self.ptr]
+
     def export_frames(self,  episode_id=None, save_root=None):
         if save_root is None:
             save_root = self.save_root
         if episode_id is None:
             episode_id = f'frames_{self.reset_count}'
-        render_frames(self.frames[:self.ptr], os.path.join(self.fix_path(save_root), episode_id))
+        render_frames(self._episode_frames(), os.path.join(self.fix_path(save_root), episode_id))
 
     def export_video(self, episode_id=None, save_root=None):
         if save_root is None:
             save_root = self.save_root
         if episode_id is None:
-            episode_id = f'video_{self.reset_count}.mp4'
-        export_video(self.frames[:self.ptr],  os.path.join(self.fix_path(save_root), episode_id), **self.video_kwargs)
+            episode_id = f'video_{self.reset_count}{self.video_ext}'
+        export_video(self._episode_frames(),  os.path.join(self.fix_path(save_root), episode_id), **self.video_kwargs)
 
     def export_both(self, episode_id, save_root=None):
         self.export_frames(f'{episode_id}_frames', save_root=save_root)
-        self.export_video(f'{episode_id}.mp4', save_root=save_root)
+        self.export_video(f'{episode_id}{self.video_ext}', save_root=save_root)
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.frames_path = None
 
     def reset(self, **kwargs):
         if self.should_record and self.ptr>0:
             self.append_current_frame()
-            if self.auto_save_images:
-                self.export_frames()
-            if self.auto_save_videos:
-                self.export_video()
+            if self.record_states:
+                self.episode_log.save(os.path.join(self.save_root, f'states_{self.reset_count}.pkl'))
+            elif not self.stream:
+                if self.auto_save_images:
+                    self.export_frames()
+                if self.auto_save_videos:
+                    self.export_video()
             self.last_save = self.reset_count
+        self.close_writer()
         del self.frames
         self.frames = None
         self.ptr = 0
@@ -137,22 +597,57 @@ class GridRecorder(gym.core.Wrapper):
         return self.env.reset(**kwargs)
 
     def append_current_frame(self):
-        if self.should_record:
+        if self.should_record and self.record_states:
+            if self.ptr == 0:
+                self.episode_log = EpisodeLog(self.env.unwrapped)
+            self.episode_log.record(self.env.unwrapped)
+            self.ptr += 1
+        elif self.should_record:
             new_frame = self.env.render(mode="rgb_array", **self.render_kwargs)
             if isinstance(new_frame, list) or len(new_frame.shape)>3:
                 new_frame = new_frame[0]
-            if self.frames is None:
-                self.frames = np.zeros(
-                    (self.max_steps, *new_frame.shape), dtype=new_frame.dtype
-                )
-            self.frames[self.ptr] = new_frame
+            if self.stream:
+                self._stream_frame(new_frame)
+            else:
+                if self.frames is None or self.ptr == len(self.frames):
+                    self._grow_frames(new_frame)
+                self.frames[self.ptr] = new_frame
             self.ptr += 1
 
+    def _grow_frames(self, frame):
+        if self.frames is None:
+            size = min(self.frame_chunk_size, self.max_steps)
+        else:
+            size = min(2 * len(self.frames), self.max_steps)
+            if size == len(self.frames):
+                raise IndexError(f"Recorded more than max_steps={self.max_steps - 1} steps.")
+        frames = np.zeros((size, *frame.shape), dtype=frame.dtype)
+        if self.frames is not None:
+            frames[:len(self.frames)] = self.frames
+        self.frames = frames
+
+    def _stream_frame(self, frame):
+        if self.auto_save_videos:
+            if self.writer is None:
+                self.writer = open_video_writer(
+                    os.path.join(self.save_root, f'video_{self.reset_count}{self.video_ext}'),
+                    **self.video_kwargs
+                )
+            self.writer.append(frame)
+        if self.auto_save_images:
+            if self.frames_path is None:
+                self.frames_path = _frames_dir(os.path.join(self.save_root, f'frames_{self.reset_count}'))
+            save_frame(frame, self.frames_path, self.ptr)
+
     def step(self, action):
         self.append_current_frame()
         obs, rew, done, info = self.env.step(action)
         return obs, rew, done, info
 
+    def close(self):
+        self.close_writer()
+        return super().close()
+
     # def export_video(
     #     self,
     #     output_path,
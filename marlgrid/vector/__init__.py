@@ -0,0 +1,3 @@
+from .batched import VecMultiGridEnv, ObjectTable
+from .subproc import SubprocVecEnv
+from .threaded import ThreadedVecEnv
@@ -0,0 +1,596 @@
+# Batched tensor engine: steps B MultiGridEnv worlds as one array program.
+
+import copy
+import gym
+import numpy as np
+
+from ..base import MultiGridEnv, MultiGrid, view_offsets
+from ..objects import GridAgent, Wall, Goal, Lava, BonusTile, Door, Key, Ball, Box, COLOR_TO_IDX
+from ..agents import GridAgentInterface, occlude_masks, prestige_color, tint_tile
+from ..atlas import TileAtlas
+
+DIR_TO_VEC = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+
+# Object types whose behavior the batched engine reproduces. Anything else (berries,
+#  boxes with contents, custom objects) has to go through MultiGridEnv.step.
+SUPPORTED_OBJECTS = (Wall, Goal, Lava, BonusTile, Door, Key, Ball, Box)
+
+
+class ObjectTable:
+    '''
+    Maps the static (non-agent) objects of a batch of worlds to integer codes, by value.
+    Two objects get the same code if they have the same class, color, state and reward
+        parameters, so codes are comparable across the worlds in a batch.
+    Code 0 is the empty cell. Per-code properties are kept in arrays so the engine can
+        look them up with fancy indexing rather than calling methods on objects.
+    '''
+    # name: (dtype, value for the empty cell / unused codes)
+    columns = {
+        'overlap': (bool, False),
+        'see_behind': (bool, True),
+        'pickup': (bool, False),
+        'terminal': (bool, False),
+        'color': (np.int64, 0),
+        # (type, color, state) as in WorldObj.encode, for symbolic observations.
+        'type_idx': (np.int64, 0),
+        'state': (np.int64, 0),
+        'is_goal': (bool, False),
+        'goal_reward': (float, 0.0),
+        'is_bonus': (bool, False),
+        'bonus_id': (np.int64, 0),
+        'n_bonus': (np.int64, 1),
+        'bonus_reward': (float, 0.0),
+        'bonus_penalty': (float, 0.0),
+        'bonus_initial_reward': (bool, True),
+        'bonus_reset_on_mistake': (bool, False),
+        'is_key': (bool, False),
+        'is_door': (bool, False),
+        'is_locked': (bool, False),
+        # Code of the object after a toggle. Locked doors only unlock if the agent is
+        #  carrying a matching key (and the code after unlocking is in "toggled").
+        'toggled': (np.int64, 0),
+    }
+
+    def __init__(self, capacity=64):
+        self.protos = [None]
+        self.code_of_signature = {None: 0}
+        for name, (dtype, default) in self.columns.items():
+            setattr(self, name, np.full(capacity, default, dtype=dtype))
+
+    def __len__(self):
+        return len(self.protos)
+
+    @staticmethod
+    def signature(obj):
+        if obj is None:
+            return None
+        return (
+            obj.__class__, obj.color, obj.state,
+            *(getattr(obj, attr, None) for attr in ('reward', 'penalty', 'n_bonus', 'initial_reward', 'reset_on_mistake'))
+        )
+
+    def _grow(self, size):
+        capacity = len(self.overlap)
+        if size <= capacity:
+            return
+        new_capacity = max(size, 2 * capacity)
+        for name, (dtype, default) in self.columns.items():
+            arr = np.full(new_capacity, default, dtype=dtype)
+            arr[:capacity] = getattr(self, name)
+            setattr(self, name, arr)
+
+    def code(self, obj):
+        sig = self.signature(obj)
+        if sig in self.code_of_signature:
+            return self.code_of_signature[sig]
+
+        if obj.__class__ not in SUPPORTED_OBJECTS or (isinstance(obj, Box) and obj.contains is not None):
+            raise NotImplementedError(
+                f"VecMultiGridEnv doesn't support objects of type {obj.__class__.__name__}.")
+
+        # The prototype is a detached copy, so later changes to the original object (or the
+        #  agents stacked on it) don't leak into the table.
+        proto = copy.copy(obj)
+        proto.agents = []
+        code = len(self.protos)
+        self.protos.append(proto)
+        self.code_of_signature[sig] = code
+        self._grow(code + 1)
+
+        self.overlap[code] = proto.can_overlap()
+        self.see_behind[code] = proto.see_behind()
+        self.pickup[code] = proto.can_pickup()
+        self.terminal[code] = isinstance(proto, (Lava, Goal))
+        self.type_idx[code], self.color[code], self.state[code] = proto.encode()
+        if isinstance(proto, Goal):
+            self.is_goal[code] = True
+            self.goal_reward[code] = proto.reward
+        if isinstance(proto, BonusTile):
+            self.is_bonus[code] = True
+            self.bonus_id[code] = proto.bonus_id
+            self.n_bonus[code] = proto.n_bonus
+            self.bonus_reward[code] = proto.reward
+            self.bonus_penalty[code] = -np.abs(proto.penalty)
+            self.bonus_initial_reward[code] = bool(proto.initial_reward)
+            self.bonus_reset_on_mistake[code] = proto.reset_on_mistake
+        self.is_key[code] = isinstance(proto, Key)
+        self.toggled[code] = code
+        if isinstance(proto, Door):
+            self.is_door[code] = True
+            self.is_locked[code] = proto.state == Door.states.locked
+            next_state = Door.states.open if proto.state == Door.states.closed else Door.states.closed
+            self.toggled[code] = self.code(self._with_state(proto, next_state))
+        return code
+
+    @staticmethod
+    def _with_state(obj, state):
+        ret = copy.copy(obj)
+        ret.state = state
+        return ret
+
+
+class VecMultiGridEnv:
+    '''
+    Steps a batch of B MultiGridEnv worlds at once.
+
+    The worlds are kept as stacked (B, W, H) arrays of object codes (see ObjectTable) plus
+        (B, n_agents) arrays of agent positions, directions and status, and every action
+        (left/right/forward/pickup/drop/toggle/done) is applied to all worlds with batched
+        indexing. Agents act in a random order each step, as in MultiGridEnv.step, so the
+        engine loops over the n_agents turns but never over the B worlds.
+
+    The wrapped envs are only used to generate layouts (their _gen_grid and agent spawning)
+        on reset; stepping never touches them.
+
+    Observations are stacked along (B, n_agents, ...), so all agents must share their
+        observation settings. Rewards are (B, n_agents) and dones are (B,).
+    '''
+    def __init__(self, envs, seed=1337, auto_reset=True):
+        self.envs = list(envs)
+        if len(self.envs) == 0:
+            raise ValueError("VecMultiGridEnv needs at least one env.")
+        env0 = self.envs[0]
+        for env in self.envs:
+            self._check_supported(env)
+            if (env.width, env.height, len(env.agents)) != (env0.width, env0.height, len(env0.agents)):
+                raise ValueError("All envs in a VecMultiGridEnv must have the same size and number of agents.")
+            if (env.ghost_mode, env.respawn, env.max_steps, env.reward_decay) != (env0.ghost_mode, env0.respawn, env0.max_steps, env0.reward_decay):
+                raise ValueError("All envs in a VecMultiGridEnv must share ghost_mode, respawn, max_steps and reward_decay.")
+
+        self.num_envs = len(self.envs)
+        self.num_agents = len(env0.agents)
+        self.width, self.height = env0.width, env0.height
+        self.ghost_mode = env0.ghost_mode
+        self.respawn = env0.respawn
+        self.max_steps = env0.max_steps
+        self.reward_decay = env0.reward_decay
+        self.auto_reset = auto_reset
+        self.seed(seed)
+
+        agents = env0.agents
+        obs_keys = ('view_size', 'view_tile_size', 'view_offset', 'observation_style',
+                    'observe_rewards', 'observe_position', 'observe_orientation')
+        for agent in agents:
+            if any(getattr(agent, k) != getattr(agents[0], k) for k in obs_keys):
+                raise ValueError("All agents in a VecMultiGridEnv must share their observation settings.")
+        self.agent_interface = agents[0]
+        self.view_size = agents[0].view_size
+        self.view_tile_size = agents[0].view_tile_size
+        self.view_offset = agents[0].view_offset
+
+        # Per-agent constants.
+        self.spawn_delay = np.array([a.spawn_delay for a in agents])
+        self.see_through_walls = np.array([a.see_through_walls for a in agents])
+        self.prestige_beta = np.array([a.prestige_beta for a in agents], dtype=float)
+        self.prestige_scale = np.array([a.prestige_scale for a in agents], dtype=float)
+        self.allow_negative_prestige = np.array([a.allow_negative_prestige for a in agents])
+        self.agent_color_names = [[a.color for a in env.agents] for env in self.envs]
+        self.agent_type_idx = np.array([a.encode()[0] for a in agents])
+
+        self.objects = ObjectTable()
+        self.atlas = TileAtlas(self.view_tile_size, palette=MultiGrid.palette)
+
+        B, N, W, H = self.num_envs, self.num_agents, self.width, self.height
+        self.grid = np.zeros((B, W, H), dtype=np.int64)
+        self.occupancy = np.zeros((B, W, H), dtype=np.int64)
+        self.pos = np.zeros((B, N, 2), dtype=np.int64)
+        self.dir = np.zeros((B, N), dtype=np.int64)
+        self.active = np.zeros((B, N), dtype=bool)
+        self.done = np.zeros((B, N), dtype=bool)
+        self.on_grid = np.zeros((B, N), dtype=bool)
+        self.carrying = np.zeros((B, N), dtype=np.int64)
+        self.prestige = np.zeros((B, N), dtype=float)
+        self.bonus_state = np.full((B, N), -1, dtype=np.int64)
+        self.arrival = np.zeros((B, N), dtype=np.int64)
+        self.arrival_counter = np.zeros(B, dtype=np.int64)
+        self.agent_color = np.zeros((B, N), dtype=np.int64)
+        self.step_count = np.zeros(B, dtype=np.int64)
+
+        self._view_offsets = view_offsets(self.view_size, self.view_offset)
+
+    @classmethod
+    def from_config(cls, env_config, num_envs, seed=1337, **kwargs):
+        from ..envs import env_from_config
+        envs = [
+            env_from_config({**env_config, 'seed': env_config.get('seed', 0) + k}, randomize_seed=False)
+            for k in range(num_envs)
+        ]
+        return cls(envs, seed=seed, **kwargs)
+
+    @staticmethod
+    def _check_supported(env):
+        if type(env).compute_rewards is not MultiGridEnv.compute_rewards:
+            raise NotImplementedError(f"VecMultiGridEnv doesn't support envs that override compute_rewards ({type(env).__name__}).")
+        if type(env).step is not MultiGridEnv.step:
+            raise NotImplementedError(f"VecMultiGridEnv doesn't support envs that override step ({type(env).__name__}).")
+        for agent in env.agents:
+            if len(getattr(agent, 'hide_item_types', [])) > 0:
+                raise NotImplementedError("VecMultiGridEnv doesn't support hide_item_types.")
+
+    def seed(self, seed=1337):
+        self.np_random, _ = gym.utils.seeding.np_random(seed)
+        return [seed]
+
+    @property
+    def observation_space(self):
+        return self.envs[0].observation_space
+
+    @property
+    def action_space(self):
+        return self.envs[0].action_space
+
+    ##### Loading worlds from the wrapped envs #####
+
+    def _load(self, b):
+        '''
+        Copy the world of self.envs[b] (freshly generated by reset) into row b of the arrays.
+        '''
+        env = self.envs[b]
+        keys = np.unique(env.grid.grid)
+        lut = np.zeros(int(keys.max()) + 1, dtype=np.int64)
+        for k in keys:
+            obj = env.grid.obj_reg.key_to_obj_map[k]
+            lut[k] = 0 if (obj is None or isinstance(obj, GridAgent)) else self.objects.code(obj)
+        self.grid[b] = lut[env.grid.grid]
+
+        self.occupancy[b] = 0
+        for n, agent in enumerate(env.agents):
+            self.on_grid[b, n] = agent.pos is not None
+            self.pos[b, n] = agent.pos if agent.pos is not None else (0, 0)
+            self.dir[b, n] = agent.dir
+            self.active[b, n] = agent.active
+            self.done[b, n] = agent.done
+            self.carrying[b, n] = self.objects.code(agent.carrying)
+            self.prestige[b, n] = agent.prestige
+            self.bonus_state[b, n] = -1 if agent.bonus_state is None else agent.bonus_state
+            self.agent_color[b, n] = COLOR_TO_IDX[agent.color]
+            # Agents are spawned in order, so that's also the order they are stacked in.
+            self.arrival[b, n] = n
+            if agent.pos is not None:
+                self.occupancy[b, agent.pos[0], agent.pos[1]] += 1
+        self.arrival_counter[b] = self.num_agents
+        self.step_count[b] = env.step_count
+
+    def reset(self):
+        self._reset_envs(np.arange(self.num_envs))
+        return self.gen_obs()
+
+    def _reset_envs(self, env_ixs):
+        for b in env_ixs:
+            self.envs[b]._reset_world()
+            self._load(b)
+
+    ##### Stepping #####
+
+    def _place_agents(self, env_ixs, agent_ixs):
+        '''
+        Spawn agents at uniformly random positions, with the rules of MultiGridEnv.try_place_obj.
+        Agents are placed one at a time within each world; like MultiGridEnv.place_obj, each
+            one is drawn directly from its world's free cells, vectorized across worlds.
+        '''
+        for n in np.unique(agent_ixs):
+            placed = env_ixs[agent_ixs == n]
+            code = self.grid[placed]
+            ok = (code == 0) | self.objects.overlap[code]
+            if not self.ghost_mode:
+                ok &= self.occupancy[placed] == 0
+            ok = ok.reshape(len(placed), -1)
+            counts = ok.sum(axis=1)
+            if (counts == 0).any():
+                raise RecursionError("No free cell to place an agent in (VecMultiGridEnv._place_agents).")
+            # Index of the r-th free cell of each world.
+            r = self.np_random.integers(0, counts)
+            x, y = np.divmod((ok.cumsum(axis=1) > r[:, None]).argmax(axis=1), self.height)
+            self.pos[placed, n, 0] = x
+            self.pos[placed, n, 1] = y
+            self.occupancy[placed, x, y] += 1
+            self.arrival[placed, n] = self.arrival_counter[placed]
+            self.arrival_counter[placed] += 1
+            self.on_grid[placed, n] = True
+            self.active[placed, n] = True
+
+    def _remove_agents(self, env_ixs, agent_ixs):
+        x, y = self.pos[env_ixs, agent_ixs].T
+        np.subtract.at(self.occupancy, (env_ixs, x, y), 1)
+        self.on_grid[env_ixs, agent_ixs] = False
+
+    def _reward(self, env_ixs, agent_ixs, rwd):
+        # Mirrors GridAgentInterface.reward.
+        rwd = np.asarray(rwd, dtype=float)
+        track = ~self.allow_negative_prestige[agent_ixs]
+        prestige = self.prestige[env_ixs, agent_ixs]
+        self.prestige[env_ixs, agent_ixs] = np.where(
+            track, np.where(rwd >= 0, prestige + rwd, 0.0), prestige
+        )
+
+    def _bonus_reward(self, env_ixs, agent_ixs, code):
+        # Mirrors BonusTile.get_reward, for all the agents that just stepped onto a bonus tile.
+        bid = self.objects.bonus_id[code]
+        state = self.bonus_state[env_ixs, agent_ixs]
+        first_bonus = state == -1
+        state = np.where(first_bonus, (bid - 1) % self.objects.n_bonus[code], state)
+        advance = (state != bid) & ((state + 1) % self.objects.n_bonus[code] == bid)
+        rwd = np.where(advance, self.objects.bonus_reward[code], self.objects.bonus_penalty[code])
+        state = np.where(advance | self.objects.bonus_reset_on_mistake[code], bid, state)
+        self.bonus_state[env_ixs, agent_ixs] = state
+        return np.where(first_bonus & ~self.objects.bonus_initial_reward[code], 0.0, rwd)
+
+    def _shuffled_order(self):
+        return self.np_random.random((self.num_envs, self.num_agents)).argsort(axis=1)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        B, N = self.num_envs, self.num_agents
+        assert actions.shape == (B, N)
+        actions_enum = GridAgentInterface.actions
+        objs = self.objects
+
+        # Spawn agents if it's time.
+        spawn = ~self.active & ~self.done & (self.step_count[:, None] >= self.spawn_delay[None, :])
+        if spawn.any():
+            self._place_agents(*np.nonzero(spawn))
+
+        step_rewards = np.zeros((B, N), dtype=float)
+        self.step_count += 1
+
+        order = self._shuffled_order()
+        all_envs = np.arange(B)
+        for turn in range(N):
+            agent_ixs = order[:, turn]
+            live = self.active[all_envs, agent_ixs]
+            b, n = all_envs[live], agent_ixs[live]
+            act = actions[b, n]
+            if ((act < 0) | (act > actions_enum.done)).any():
+                raise ValueError(f"Environment can't handle action {act[(act < 0) | (act > actions_enum.done)][0]}.")
+
+            cur = self.pos[b, n]
+            fwd = cur + DIR_TO_VEC[self.dir[b, n]]
+            fx, fy = fwd[:, 0], fwd[:, 1]
+            fwd_code = self.grid[b, fx, fy]
+            # The object the single-env grid would hold at fwd: an agent if the cell is empty but occupied.
+            fwd_is_agent = (fwd_code == 0) & (self.occupancy[b, fx, fy] > 0)
+
+            # Rotate
+            left = act == actions_enum.left
+            right = act == actions_enum.right
+            self.dir[b[left], n[left]] = (self.dir[b[left], n[left]] - 1) % 4
+            self.dir[b[right], n[right]] = (self.dir[b[right], n[right]] + 1) % 4
+
+            # Move forward
+            move = (act == actions_enum.forward) & ((fwd_code == 0) | objs.overlap[fwd_code])
+            if not self.ghost_mode:
+                move &= ~fwd_is_agent
+            if move.any():
+                bm, nm, code = b[move], n[move], fwd_code[move]
+                self._remove_agents(bm, nm)
+                self.pos[bm, nm] = fwd[move]
+                self.occupancy[bm, fx[move], fy[move]] += 1
+                self.on_grid[bm, nm] = True
+                self.arrival[bm, nm] = self.arrival_counter[bm]
+                self.arrival_counter[bm] += 1
+
+                rewarding = objs.is_goal[code] | objs.is_bonus[code]
+                if rewarding.any():
+                    br, nr, cr = bm[rewarding], nm[rewarding], code[rewarding]
+                    rwd = np.where(objs.is_goal[cr], objs.goal_reward[cr], 0.0)
+                    bonus = objs.is_bonus[cr]
+                    if bonus.any():
+                        rwd[bonus] = self._bonus_reward(br[bonus], nr[bonus], cr[bonus])
+                    if bool(self.reward_decay):
+                        rwd = rwd * (1.0-0.9*(self.step_count[br]/self.max_steps))
+                    step_rewards[br, nr] += rwd
+                    self._reward(br, nr, rwd)
+
+                terminal = objs.terminal[code]
+                self.done[bm[terminal], nm[terminal]] = True
+
+            # Pick up an object
+            pickup = (act == actions_enum.pickup) & objs.pickup[fwd_code] & (self.carrying[b, n] == 0)
+            if pickup.any():
+                self.carrying[b[pickup], n[pickup]] = fwd_code[pickup]
+                self.grid[b[pickup], fx[pickup], fy[pickup]] = 0
+
+            # Drop an object
+            drop = (act == actions_enum.drop) & (fwd_code == 0) & ~fwd_is_agent & (self.carrying[b, n] != 0)
+            if drop.any():
+                self.grid[b[drop], fx[drop], fy[drop]] = self.carrying[b[drop], n[drop]]
+                self.carrying[b[drop], n[drop]] = 0
+
+            # Toggle/activate an object
+            toggle = (act == actions_enum.toggle) & objs.is_door[fwd_code]
+            if toggle.any():
+                bt, nt, ct = b[toggle], n[toggle], fwd_code[toggle]
+                carried = self.carrying[bt, nt]
+                has_key = objs.is_key[carried] & (objs.color[carried] == objs.color[ct])
+                self.grid[bt, fx[toggle], fy[toggle]] = np.where(
+                    objs.is_locked[ct] & ~has_key, ct, objs.toggled[ct]
+                )
+
+            # Done action (not used by default)
+            finish = act == actions_enum.done
+            self.done[b[finish], n[finish]] = True
+
+            # GridAgentInterface.on_step
+            self.prestige[b, n] *= self.prestige_beta[n]
+
+        # Respawn or deactivate agents that are done.
+        if self.respawn:
+            for n in range(N):
+                db = np.nonzero(self.done[:, n])[0]
+                if len(db):
+                    dn = np.full_like(db, n)
+                    self._remove_agents(db, dn)
+                    self.done[db, dn] = False
+                    self.active[db, dn] = False
+                    self.carrying[db, dn] = 0
+                    self._place_agents(db, dn)
+        else:
+            self.active[self.done] = False
+
+        dones = (self.step_count >= self.max_steps) | self.done.all(axis=1)
+
+        if self.auto_reset and dones.any():
+            self._reset_envs(np.nonzero(dones)[0])
+
+        obs = self.gen_obs()
+        return obs, step_rewards, dones, [{} for _ in range(B)]
+
+    ##### Observations #####
+
+    def _view_indices(self):
+        # Grid coordinates of every agent's view window, (B, N, V, V) each.
+        offsets = self._view_offsets[self.dir]
+        return (
+            self.pos[..., 0, None, None] + offsets[:, :, 0],
+            self.pos[..., 1, None, None] + offsets[:, :, 1],
+        )
+
+    def _top_agents(self):
+        '''
+        (B, W, H) index of the agent drawn in each cell, or -1. Like MultiGrid.render_tile,
+            that's the agent that got there first.
+        '''
+        B, N = self.num_envs, self.num_agents
+        b, n = np.nonzero(self.on_grid)
+        x, y = self.pos[b, n].T
+        first = np.full(self.grid.shape, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first, (b, x, y), self.arrival[b, n])
+        top = np.full(self.grid.shape, -1, dtype=np.int64)
+        is_top = self.arrival[b, n] == first[b, x, y]
+        top[b[is_top], x[is_top], y[is_top]] = n[is_top]
+        return top
+
+    def _agent_appearance(self):
+        '''
+        (B, N) integer describing how each agent is drawn: color, direction and prestige tint.
+        '''
+        tinted = self.active & np.array([[c == 'prestige' for c in colors] for colors in self.agent_color_names])
+        tint = prestige_color(self.prestige, self.prestige_scale[None, :], False)
+        tint_neg = prestige_color(self.prestige, self.prestige_scale[None, :], True)
+        tint = np.where(self.allow_negative_prestige[None, :, None], tint_neg, tint)
+        tint = np.where(tinted[..., None], tint, 0)
+        return (
+            ((self.agent_color * 4 + self.dir) * 2 + tinted) * (1 << 16)
+            + tint[..., 0] * (1 << 8) + tint[..., 2]
+        )
+
+    def _render_tile(self, code, appearance):
+        '''
+        Render one view cell, given its object code and agent appearance (-1 if there's no agent).
+        Reproduces MultiGrid.render_tile.
+        '''
+        ts = self.view_tile_size
+        obj = self.objects.protos[code]
+        if appearance < 0:
+            agent_img = None
+        else:
+            tint = appearance % (1 << 16)
+            appearance //= (1 << 16)
+            tinted = appearance % 2
+            color, dir = divmod(appearance // 2, 4)
+            agent = GridAgent(color=list(COLOR_TO_IDX.keys())[color], state=dir)
+            agent_img = MultiGrid.cache_render_obj(agent, ts, 3)
+            if tinted:
+                agent_img = tint_tile(agent_img, np.array([tint // (1 << 8), 0, tint % (1 << 8)]))
+
+        if obj is None and agent_img is None:
+            img = MultiGrid.cache_render_obj(None, ts, 3)
+        else:
+            if obj is None:
+                img = agent_img
+            else:
+                img = MultiGrid.cache_render_obj(obj, ts, 3)
+                if agent_img is not None:
+                    img = MultiGrid.blend_tiles(img, agent_img)
+            if (img[([0,0,-1,-1],[0,-1,0,-1])]==0).all(axis=-1).any():
+                img = img + MultiGrid.cache_render_obj(None, ts, 3)
+        return img
+
+    def _symbolic_obs(self, codes, tops, vis):
+        '''
+        (B, N, V, V, 3) (type, color, state) encoding of each view, like MultiGridEnv.gen_symbolic_obs.
+        '''
+        objs = self.objects
+        B, N = self.num_envs, self.num_agents
+        b = np.arange(B)[:, None, None, None]
+        safe_tops = np.maximum(tops, 0)
+        has_agent = tops >= 0
+        obs = np.stack((
+            np.where(has_agent, self.agent_type_idx[safe_tops], objs.type_idx[codes]),
+            np.where(has_agent, self.agent_color[b, safe_tops], objs.color[codes]),
+            np.where(has_agent, 4 * safe_tops + self.dir[b, safe_tops], objs.state[codes]),
+        ), axis=-1)
+        obs[~vis] = 0
+        return obs.astype(np.uint8)
+
+    def gen_obs(self):
+        B, N, V, ts = self.num_envs, self.num_agents, self.view_size, self.view_tile_size
+        vx, vy = self._view_indices()
+        b = np.arange(B)[:, None, None, None]
+
+        # Gather the views from padded copies of the world arrays, so that cells outside
+        #  the grid read as empty (like MultiGrid.slice).
+        pad = ((0, 0), (V, V), (V, V))
+        codes = np.pad(self.grid, pad)[b, vx + V, vy + V]
+        tops = np.pad(self._top_agents(), pad, constant_values=-1)[b, vx + V, vy + V]
+
+        # Each agent always sees itself on its own cell.
+        view_pos = self.agent_interface.get_view_pos()
+        tops[:, :, view_pos[0], view_pos[1]] = np.arange(N)[None, :]
+
+        # Visibility
+        vis = occlude_masks(self.objects.see_behind[codes], view_pos, self.see_through_walls[None, :], parallel=True)
+        vis &= self.active[..., None, None]
+
+        if self.agent_interface.observation_style == 'symbolic':
+            return self._symbolic_obs(codes, tops, vis)
+
+        # Assemble the per-cell tile keys, look up (or render) the atlas tile of each distinct
+        #  one, and gather the POV images from the atlas.
+        appearance = self._agent_appearance()
+        cell_appearance = np.where(tops >= 0, appearance[b, np.maximum(tops, 0)], -1)
+        keys = np.where(vis, ((codes + 1) << 32) | (cell_appearance + 1), -1)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        lut = np.array([
+            TileAtlas.SHADOW if key < 0 else
+            self.atlas.index(key, self._render_tile, (key >> 32) - 1, (key & (2**32 - 1)) - 1)
+            for key in unique_keys.tolist()
+        ], dtype=np.int64)
+
+        agent = self.agent_interface
+        orientation = -(self.dir + 1) % 4
+        pov = self.atlas.compose(
+            lut[inverse].reshape(B, N, V, V), orientation, paletted=agent.observation_style == 'palette'
+        )
+
+        if agent.observation_style in ('palette', 'image'):
+            return pov
+        ret = {'pov': pov}
+        if agent.observe_rewards:
+            # GridAgentInterface.step_reward is reset to zero every step.
+            ret['reward'] = np.zeros((B, N))
+        if agent.observe_position:
+            ret['position'] = np.where(self.on_grid[..., None], self.pos, 0) / np.array([self.width, self.height], dtype=float)
+        if agent.observe_orientation:
+            ret['orientation'] = self.dir.copy()
+        return ret
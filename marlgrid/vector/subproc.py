@@ -0,0 +1,285 @@
+# Multi-process vector env that moves observations through shared memory.
+
+import functools
+import multiprocessing as mp
+import numpy as np
+import gym
+from multiprocessing import shared_memory
+
+# One-byte commands sent over the pipes. Using send_bytes/recv_bytes means that nothing
+#  gets pickled on the hot path; the data itself lives in the shared buffers.
+CMD_STEP = b's'
+CMD_RESET = b'r'
+CMD_CLOSE = b'c'
+ACK = b'k'
+
+
+def _leaf_spec(space):
+    if isinstance(space, gym.spaces.Box):
+        return space.shape, space.dtype
+    elif isinstance(space, gym.spaces.Discrete):
+        return (), np.int64
+    else:
+        raise ValueError(f"Can't make a shared buffer for a {space.__class__.__name__} space.")
+
+
+class SharedArrays:
+    '''
+    A set of named numpy arrays backed by multiprocessing.shared_memory blocks.
+    The specs (name -> (shape, dtype)) are picklable, so workers can attach to the same
+        blocks with SharedArrays.attach(specs, block_names).
+    '''
+    def __init__(self, specs, block_names=None):
+        self.specs = specs
+        self.owner = block_names is None
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in specs.items():
+            nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            if self.owner:
+                block = shared_memory.SharedMemory(create=True, size=nbytes)
+            else:
+                block = shared_memory.SharedMemory(name=block_names[name])
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    @property
+    def block_names(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+def observation_specs(observation_space, num_envs):
+    '''
+    Buffer specs for the per-agent observation spaces of a MultiGridEnv (a Tuple of Box or
+        Dict spaces), stacked along a leading num_envs axis.
+    Keys are "obs/<agent>" or "obs/<agent>/<dict key>".
+    '''
+    specs = {}
+    for k, space in enumerate(observation_space.spaces):
+        if isinstance(space, gym.spaces.Dict):
+            for key, subspace in space.spaces.items():
+                shape, dtype = _leaf_spec(subspace)
+                specs[f'obs/{k}/{key}'] = ((num_envs, *shape), dtype)
+        else:
+            shape, dtype = _leaf_spec(space)
+            specs[f'obs/{k}'] = ((num_envs, *shape), dtype)
+    return specs
+
+
+def write_obs(buffers, env_ix, obs):
+    for k, agent_obs in enumerate(obs):
+        if isinstance(agent_obs, dict):
+            for key, value in agent_obs.items():
+                buffers[f'obs/{k}/{key}'][env_ix] = value
+        else:
+            buffers[f'obs/{k}'][env_ix] = agent_obs
+
+
+def read_obs(buffers, observation_space, ixs=slice(None), copy=True):
+    f = np.copy if copy else (lambda x: x)
+    ret = []
+    for k, space in enumerate(observation_space.spaces):
+        if isinstance(space, gym.spaces.Dict):
+            ret.append({key: f(buffers[f'obs/{k}/{key}'][ixs]) for key in space.spaces})
+        else:
+            ret.append(f(buffers[f'obs/{k}'][ixs]))
+    return ret
+
+
+def _worker(env_fn, env_ixs, conn, specs, block_names, auto_reset, shared):
+    '''
+    Steps the envs in env_ixs. With shared=True, actions are read from and results are written
+        to the shared buffers, and the pipe only carries one-byte commands. Otherwise results are
+        pickled through the pipe (the conventional path, kept for comparison).
+    '''
+    buffers = SharedArrays(specs, block_names) if shared else None
+    envs = {ix: env_fn(ix) for ix in env_ixs}
+    try:
+        while True:
+            if shared:
+                cmd = conn.recv_bytes()
+                actions = buffers['actions']
+            else:
+                cmd, actions = conn.recv()
+            if cmd == CMD_CLOSE:
+                break
+            results = []
+            for ix, env in envs.items():
+                if cmd == CMD_RESET:
+                    obs, rew, done = env.reset(), 0, False
+                else:
+                    obs, rew, done, _ = env.step(actions[ix])
+                    if done and auto_reset:
+                        obs = env.reset()
+                if shared:
+                    write_obs(buffers, ix, obs)
+                    buffers['rewards'][ix] = rew
+                    buffers['dones'][ix] = done
+                else:
+                    results.append((ix, obs, rew, done))
+            if shared:
+                conn.send_bytes(ACK)
+            else:
+                conn.send(results)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for env in envs.values():
+            env.close()
+        if shared:
+            buffers.close()
+        conn.close()
+
+
+def _env_from_config(env_config, seed, env_ix):
+    from ..envs import env_from_config
+    return env_from_config({**env_config, 'seed': seed + env_ix}, randomize_seed=False)
+
+
+class SubprocVecEnv:
+    '''
+    Steps num_envs MultiGridEnvs in worker processes.
+
+    Observations, rewards and done flags are written by the workers straight into
+        multiprocessing.shared_memory arrays shaped from each agent's observation_space,
+        and actions are read from a shared array, so nothing is pickled per step.
+        With shared_memory=False, results are instead pickled through pipes like in generic
+        gym vector envs, which is useful as a baseline.
+
+    env_fn is called in the workers with the index of the env to build, and must be
+        picklable if the start method isn't "fork". Each worker steps
+        num_envs/num_workers envs serially.
+
+    step() returns obs as a list over agents of arrays stacked along num_envs (or dicts of
+        them, for observation_style='rich'), rewards as (num_envs, n_agents) and dones as
+        (num_envs,). Envs that finish are reset inside the worker if auto_reset is set, and
+        the returned observation is the first one of the new episode.
+    '''
+    def __init__(self, env_fn, num_envs, num_workers=None, auto_reset=True, shared_memory=True, copy=True, context=None):
+        self.num_envs = num_envs
+        self.num_workers = min(num_envs, num_workers or mp.cpu_count())
+        self.shared_memory = shared_memory
+        self.copy = copy
+        self.closed = False
+
+        dummy = env_fn(0)
+        self.observation_space = dummy.observation_space
+        self.action_space = dummy.action_space
+        self.num_agents = len(dummy.agents)
+        dummy.close()
+        del dummy
+
+        self.specs = {
+            **observation_specs(self.observation_space, num_envs),
+            'rewards': ((num_envs, self.num_agents), np.float64),
+            'dones': ((num_envs,), np.bool_),
+            'actions': ((num_envs, self.num_agents), np.int64),
+        }
+        self.buffers = SharedArrays(self.specs) if shared_memory else None
+        if not shared_memory:
+            self._results = {
+                'rewards': np.zeros((num_envs, self.num_agents)),
+                'dones': np.zeros(num_envs, dtype=bool),
+                'obs': [None] * num_envs,
+            }
+
+        ctx = mp.get_context(context)
+        self.conns = []
+        self.processes = []
+        for env_ixs in np.array_split(np.arange(num_envs), self.num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    env_fn, env_ixs.tolist(), child_conn, self.specs,
+                    self.buffers.block_names if shared_memory else None,
+                    auto_reset, shared_memory,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    @classmethod
+    def from_config(cls, env_config, num_envs, seed=0, **kwargs):
+        return cls(functools.partial(_env_from_config, env_config, seed), num_envs, **kwargs)
+
+    def _send(self, cmd, actions=None):
+        for conn in self.conns:
+            if self.shared_memory:
+                conn.send_bytes(cmd)
+            else:
+                conn.send((cmd, actions))
+
+    def _collect(self):
+        for conn in self.conns:
+            if self.shared_memory:
+                conn.recv_bytes()
+            else:
+                for ix, obs, rew, done in conn.recv():
+                    self._results['obs'][ix] = obs
+                    self._results['rewards'][ix] = rew
+                    self._results['dones'][ix] = done
+
+        if self.shared_memory:
+            obs = read_obs(self.buffers, self.observation_space, copy=self.copy)
+            rewards, dones = self.buffers['rewards'], self.buffers['dones']
+            if self.copy:
+                rewards, dones = rewards.copy(), dones.copy()
+            return obs, rewards, dones
+
+        per_env = self._results['obs']
+        obs = []
+        for k in range(self.num_agents):
+            if isinstance(per_env[0][k], dict):
+                obs.append({key: np.stack([o[k][key] for o in per_env]) for key in per_env[0][k]})
+            else:
+                obs.append(np.stack([o[k] for o in per_env]))
+        return obs, self._results['rewards'].copy(), self._results['dones'].copy()
+
+    def reset(self):
+        self._send(CMD_RESET)
+        obs, _, _ = self._collect()
+        return obs
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if self.shared_memory:
+            self.buffers['actions'][:] = actions
+        self._send(CMD_STEP, actions)
+        obs, rewards, dones = self._collect()
+        return obs, rewards, dones, [{} for _ in range(self.num_envs)]
+
+    def close(self):
+        if self.closed:
+            return
+        for conn in self.conns:
+            try:
+                if self.shared_memory:
+                    conn.send_bytes(CMD_CLOSE)
+                else:
+                    conn.send((CMD_CLOSE, None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        if self.buffers is not None:
+            self.buffers.close()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
@@ -0,0 +1,87 @@
+# Thread-pool vector env.
+
+import functools
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .subproc import observation_specs, write_obs, read_obs, _env_from_config
+
+
+class ThreadedVecEnv:
+    '''
+    Steps num_envs MultiGridEnvs from a pool of threads in a single process.
+
+    The expensive part of a step - extracting and rotating each agent's view, occlusion,
+        and gathering the tiles of the POV images - runs in numba kernels and numpy gathers
+        that release the GIL (see marlgrid.kernels), so the threads overlap for most of the step. This
+        avoids the memory and startup cost of one process per env.
+
+    Results are written by the threads into preallocated arrays shaped from each agent's
+        observation_space, and returned in the same layout as SubprocVecEnv: obs as a list
+        over agents of arrays stacked along num_envs, rewards as (num_envs, n_agents) and
+        dones as (num_envs,).
+    '''
+    def __init__(self, env_fn, num_envs, num_threads=None, auto_reset=True, copy=True):
+        self.num_envs = num_envs
+        self.num_threads = min(num_envs, num_threads or os.cpu_count() or 1)
+        self.auto_reset = auto_reset
+        self.copy = copy
+
+        self.envs = [env_fn(ix) for ix in range(num_envs)]
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.num_agents = len(self.envs[0].agents)
+
+        specs = {
+            **observation_specs(self.observation_space, num_envs),
+            'rewards': ((num_envs, self.num_agents), np.float64),
+            'dones': ((num_envs,), np.bool_),
+        }
+        self.buffers = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+        self.chunks = [chunk.tolist() for chunk in np.array_split(np.arange(num_envs), self.num_threads)]
+        self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+
+    @classmethod
+    def from_config(cls, env_config, num_envs, seed=0, **kwargs):
+        return cls(functools.partial(_env_from_config, env_config, seed), num_envs, **kwargs)
+
+    def _reset_chunk(self, env_ixs):
+        for ix in env_ixs:
+            write_obs(self.buffers, ix, self.envs[ix].reset())
+            self.buffers['rewards'][ix] = 0
+            self.buffers['dones'][ix] = False
+
+    def _step_chunk(self, env_ixs, actions):
+        for ix in env_ixs:
+            obs, rew, done, _ = self.envs[ix].step(actions[ix])
+            if done and self.auto_reset:
+                obs = self.envs[ix].reset()
+            write_obs(self.buffers, ix, obs)
+            self.buffers['rewards'][ix] = rew
+            self.buffers['dones'][ix] = done
+
+    def _run(self, fn, *args):
+        # list() propagates exceptions raised in the threads.
+        list(self.pool.map(lambda chunk: fn(chunk, *args), self.chunks))
+
+    def _collect(self):
+        obs = read_obs(self.buffers, self.observation_space, copy=self.copy)
+        rewards, dones = self.buffers['rewards'], self.buffers['dones']
+        if self.copy:
+            rewards, dones = rewards.copy(), dones.copy()
+        return obs, rewards, dones
+
+    def reset(self):
+        self._run(self._reset_chunk)
+        return self._collect()[0]
+
+    def step(self, actions):
+        self._run(self._step_chunk, np.asarray(actions))
+        obs, rewards, dones = self._collect()
+        return obs, rewards, dones, [{} for _ in range(self.num_envs)]
+
+    def close(self):
+        self.pool.shutdown()
+        for env in self.envs:
+            env.close()
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredMultiGrid, ClutteredGoalCycleEnv, EmptyMultiGrid, DoorKeyEnv
+from marlgrid.agents import GridAgentInterface
+
+
+def make_goalcycle():
+    return ClutteredGoalCycleEnv(
+        agents=[GridAgentInterface(color='prestige', view_size=5, spawn_delay=3*k) for k in range(5)],
+        grid_size=11, clutter_density=0.15, n_bonus_tiles=3, reset_on_mistake=True, max_steps=150, seed=4,
+    )
+
+def make_goalcycle_no_ghost():
+    return ClutteredGoalCycleEnv(
+        agents=[GridAgentInterface(color='prestige', view_size=5) for _ in range(6)],
+        grid_size=8, clutter_density=0.1, n_bonus_tiles=2, ghost_mode=False, max_steps=150, seed=4,
+    )
+
+def make_cluttered():
+    return ClutteredMultiGrid(
+        agents=[GridAgentInterface(color='red', view_size=5) for _ in range(6)],
+        grid_size=9, n_clutter=10, respawn=True, max_steps=200, seed=2,
+    )
+
+def make_empty():
+    return EmptyMultiGrid(
+        agents=[GridAgentInterface(color='blue', view_size=3) for _ in range(8)],
+        grid_size=6, max_steps=100, seed=1,
+    )
+
+def make_doorkey():
+    return DoorKeyEnv(
+        agents=[GridAgentInterface(color=c, view_size=5) for c in ['red', 'blue']],
+        grid_size=7, max_steps=200, seed=2,
+    )
+
+
+def rollout(make_env, compiled_step, n_actions, n_episodes=3):
+    env = make_env()
+    env.compiled_step = compiled_step
+    rng = np.random.default_rng(0)
+    trajectory = []
+    for _ in range(n_episodes):
+        obs = env.reset()
+        trajectory.append((obs, None, None))
+        done = False
+        while not done:
+            obs, rewards, done, _ = env.step(rng.integers(0, n_actions, size=len(env.agents)))
+            trajectory.append((
+                obs, rewards, done,
+                env.grid.grid.copy(), list(env.grid.free_cells),
+                [(agent.dir, None if agent.pos is None else tuple(agent.pos), agent.prestige) for agent in env.agents],
+            ))
+    return trajectory
+
+
+def assert_equal(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for k in a:
+            assert_equal(a[k], b[k])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_equal(x, y)
+    else:
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('make_env', [make_goalcycle, make_goalcycle_no_ghost, make_cluttered, make_empty, make_doorkey])
+@pytest.mark.parametrize('n_actions', [3, 7])
+def test_compiled_step_matches_python_loop(make_env, n_actions):
+    # With n_actions=3 every step goes through the move_agents kernel; with 7, steps that
+    #  include other actions fall back to the Python loop.
+    assert_equal(rollout(make_env, True, n_actions), rollout(make_env, False, n_actions))
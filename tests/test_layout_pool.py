@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredGoalCycleEnv, EmptyMultiGrid
+from marlgrid.agents import GridAgentInterface
+from marlgrid.layouts import LayoutPool
+
+
+def make_env(seed=0):
+    return ClutteredGoalCycleEnv(
+        agents=[GridAgentInterface(color=c, view_size=5, view_tile_size=4) for c in ['red', 'blue']],
+        grid_size=9, clutter_density=0.2, n_bonus_tiles=3, max_steps=40, seed=seed,
+    )
+
+
+def describe(layout):
+    keys, objects, spawn_kwargs = layout
+    return keys.tolist(), [obj.encode() for obj in objects], spawn_kwargs
+
+
+def test_layouts_depend_only_on_seed_and_index():
+    # Generated in order, in a background thread, or from an env in another state.
+    pools = [
+        LayoutPool(make_env(), size=6, seed=5),
+        LayoutPool(make_env(), size=6, seed=5, background=True),
+        LayoutPool(make_env(seed=1), size=6, seed=5),
+    ]
+    pools[1].thread.join()
+    for k in reversed(range(6)):
+        layouts = [describe(pool.get(k)) for pool in pools]
+        assert layouts[0] == layouts[1] == layouts[2]
+    assert describe(LayoutPool(make_env(), size=6, seed=6).get(0)) != describe(pools[0].get(0))
+
+
+def test_pooled_envs_are_reproducible():
+    def rollout():
+        env = make_env(seed=3)
+        env.enable_layout_pool(size=4, background=True)
+        rng = np.random.default_rng(0)
+        obs = [np.stack(env.reset())]
+        for _ in range(120):
+            step_obs, _, done, _ = env.step(rng.integers(0, 3, size=len(env.agents)))
+            obs.append(np.stack(step_obs))
+            if done:
+                obs.append(np.stack(env.reset()))
+        return obs
+    np.testing.assert_array_equal(rollout(), rollout())
+
+
+class PlacesAgents(EmptyMultiGrid):
+    def _gen_grid(self, width, height):
+        super()._gen_grid(width, height)
+        self.place_obj(self.agents[0])
+
+class SetsOtherAttributes(EmptyMultiGrid):
+    def _gen_grid(self, width, height):
+        super()._gen_grid(width, height)
+        self.goal_pos = tuple(self.np_random.integers(1, 5, 2))
+
+class ChangesAgents(EmptyMultiGrid):
+    def _gen_grid(self, width, height):
+        super()._gen_grid(width, height)
+        self.agents.append(self.agents[0])
+
+
+@pytest.mark.parametrize('env_class', [PlacesAgents, SetsOtherAttributes, ChangesAgents])
+def test_pool_rejects_gen_grid_it_cant_replay(env_class):
+    env = env_class(agents=[GridAgentInterface() for _ in range(2)], grid_size=7)
+    agent_cells = dict(env.agent_index.cells)
+    agents = list(env.agents)
+    with pytest.raises(ValueError, match="can't be used with a LayoutPool"):
+        env.enable_layout_pool(size=4)
+    assert env.layout_pool is None
+    # Generating the rejected layout didn't touch the live env.
+    assert dict(env.agent_index.cells) == agent_cells
+    assert env.agents == agents
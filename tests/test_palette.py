@@ -0,0 +1,23 @@
+import numpy as np
+
+from marlgrid.atlas import highlight
+from marlgrid.objects import COLORS
+from marlgrid.palette import Palette
+
+
+def test_palette_is_fixed():
+    a, b = Palette(), Palette()
+    assert a.n_colors <= 256
+    np.testing.assert_array_equal(a.colors, b.colors)
+
+    img = np.random.default_rng(0).integers(0, 256, size=(64, 64, 3)).astype(np.uint8)
+    # Indexing doesn't depend on what was indexed before.
+    np.testing.assert_array_equal(a.index(img), b.index(img[::-1])[::-1])
+    assert np.abs(a.decode(a.index(img)).astype(int) - img).max() <= 25
+
+
+def test_palette_named_colors_are_exact():
+    palette = Palette()
+    named = np.array([(0, 0, 0), *COLORS.values()], dtype=np.uint8)
+    for colors in [named, highlight(named)]:
+        np.testing.assert_array_equal(palette.decode(palette.index(colors)), colors)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from marlgrid.envs import EmptyMultiGrid
+from marlgrid.objects import Wall
+from marlgrid.agents import GridAgentInterface
+
+
+def make_env():
+    env = EmptyMultiGrid(agents=[GridAgentInterface(view_size=3)], grid_size=9, max_steps=10, seed=0)
+    env.reset()
+    return env
+
+
+def test_place_obj_respects_reject_fn():
+    env = make_env()
+    for _ in range(20):
+        pos = env.place_obj(Wall(), reject_fn=lambda pos: pos[0] < 4)
+        assert pos[0] >= 4 and isinstance(env.grid.get(*pos), Wall)
+
+
+def test_place_obj_caps_reject_fn_calls_at_max_tries():
+    env = make_env()
+    calls = []
+    def reject_all(pos):
+        calls.append(tuple(pos))
+        return True
+    with pytest.raises(RecursionError):
+        env.place_obj(Wall(), reject_fn=reject_all, max_tries=5)
+    assert len(calls) == 5
+
+    # With more tries than candidates, every free cell is tried once.
+    calls.clear()
+    n_free = len(env.grid.free_cells)
+    with pytest.raises(RecursionError):
+        env.place_obj(Wall(), reject_fn=reject_all, max_tries=1000)
+    assert len(calls) == len(set(calls)) == n_free
@@ -0,0 +1,61 @@
+import copy
+import numpy as np
+
+from marlgrid.envs import DoorKeyEnv
+from marlgrid.objects import Door
+from marlgrid.agents import GridAgentInterface
+
+
+def make_env():
+    env = DoorKeyEnv(
+        agents=[GridAgentInterface(color=c, view_size=5) for c in ['red', 'blue']],
+        grid_size=7, max_steps=200, seed=2,
+    )
+    env.reset()
+    return env
+
+
+def find_door(reg):
+    return next((key, obj) for key, obj in reg.key_to_obj_map.items() if isinstance(obj, Door))
+
+
+def test_registry_follows_object_changes():
+    env = make_env()
+    reg = env.grid.obj_reg
+    key, door = find_door(reg)
+    for state in Door.states:
+        door.state = state
+        assert reg.opaque[key] == (not door.see_behind())
+        assert reg.overlappable[key] == door.can_overlap()
+        assert tuple(reg.encoding[key]) == door.encode()
+    door.color = 'blue'
+    assert tuple(reg.encoding[key]) == door.encode()
+
+
+def test_copies_have_their_own_registry():
+    env = make_env()
+    key, door = find_door(env.grid.obj_reg)
+    door.state = Door.states.closed
+    other = copy.deepcopy(env)
+    other_key, other_door = find_door(other.grid.obj_reg)
+    other_door.state = Door.states.open
+    assert env.grid.obj_reg.opaque[key] and not other.grid.obj_reg.opaque[other_key]
+
+    state = env.get_state()
+    door.state = Door.states.open
+    env.set_state(state)
+    assert env.grid.obj_reg.opaque[key]
+    door.state = Door.states.open
+    assert not env.grid.obj_reg.opaque[key]
+
+
+def test_cells_follow_the_grid():
+    env = make_env()
+    grid = env.grid
+    key, door = find_door(grid.obj_reg)
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        env.step(rng.integers(0, 7, size=len(env.agents)))
+        np.testing.assert_array_equal(env.grid.cells, env.grid.obj_reg.encoding[env.grid.grid])
+    door.state = Door.states.locked
+    np.testing.assert_array_equal(grid.cells[grid.grid == key], [door.encode()])
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredGoalCycleEnv
+from marlgrid.agents import GridAgentInterface
+
+
+def make_env(observation_style):
+    return ClutteredGoalCycleEnv(
+        agents=[
+            GridAgentInterface(color=c, view_size=5, view_tile_size=6, observation_style=observation_style)
+            for c in ['red', 'blue', 'prestige']
+        ],
+        grid_size=9, clutter_density=0.15, n_bonus_tiles=2, max_steps=50, seed=3,
+    )
+
+
+@pytest.mark.parametrize('observation_style', ['symbolic', 'palette'])
+def test_render_draws_non_image_views_as_images(observation_style):
+    # The side panels show the same RGB views whatever the agents observe.
+    env, image_env = make_env(observation_style), make_env('image')
+    env.reset()
+    image_env.reset()
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        actions = rng.integers(0, 3, size=len(env.agents))
+        env.step(actions)
+        image_env.step(actions)
+        np.testing.assert_array_equal(env.render(mode='rgb_array'), image_env.render(mode='rgb_array'))
@@ -0,0 +1,67 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredGoalCycleEnv, DoorKeyEnv
+from marlgrid.agents import GridAgentInterface
+
+
+def make_goalcycle():
+    return ClutteredGoalCycleEnv(
+        agents=[GridAgentInterface(color='prestige', view_size=5, view_tile_size=4, spawn_delay=2*k) for k in range(3)],
+        grid_size=9, clutter_density=0.15, n_bonus_tiles=3, respawn=True, max_steps=80, seed=4,
+    )
+
+def make_doorkey():
+    return DoorKeyEnv(
+        agents=[GridAgentInterface(color=c, view_size=5, view_tile_size=4) for c in ['red', 'blue']],
+        grid_size=7, max_steps=80, seed=2,
+    )
+
+
+def rollout(env, actions):
+    trajectory = []
+    for a in actions:
+        obs, rewards, done, _ = env.step(a)
+        trajectory.append((np.stack(obs), rewards, done, env.grid.encode(), env.render(mode='rgb_array')))
+        if done:
+            trajectory.append(np.stack(env.reset()))
+    return trajectory
+
+
+def assert_same(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        if isinstance(x, tuple):
+            for u, v in zip(x, y):
+                np.testing.assert_array_equal(u, v)
+        else:
+            np.testing.assert_array_equal(x, y)
+
+
+@pytest.mark.parametrize('layout_pool', [False, True])
+@pytest.mark.parametrize('make_env', [make_goalcycle, make_doorkey])
+def test_state_round_trip_and_pickling(make_env, layout_pool):
+    env = make_env()
+    if layout_pool:
+        env.enable_layout_pool(size=4)
+    rng = np.random.default_rng(1)
+    env.reset()
+    for _ in range(30):
+        env.step(rng.integers(0, 7, size=len(env.agents)))
+    actions = [rng.integers(0, 7, size=len(env.agents)) for _ in range(150)]
+
+    state = env.get_state()
+    pickled = pickle.loads(pickle.dumps(env))
+    copied = copy.deepcopy(env)
+
+    expected = rollout(env, actions)
+    env.set_state(state)
+    assert_same(rollout(env, actions), expected)
+    # The snapshot isn't consumed by set_state.
+    env.set_state(state)
+    assert_same(rollout(env, actions), expected)
+    assert_same(rollout(pickled, actions), expected)
+    assert_same(rollout(copied, actions), expected)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredGoalCycleEnv, ClutteredMultiGrid, DoorKeyEnv
+from marlgrid.agents import GridAgentInterface
+from marlgrid.vector import VecMultiGridEnv
+
+
+def make_goalcycle(seed, observation_style):
+    return ClutteredGoalCycleEnv(
+        agents=[
+            GridAgentInterface(color=c, view_size=5, view_offset=seed % 2, view_tile_size=6, observation_style=observation_style)
+            for c in ['red', 'blue', 'prestige']
+        ],
+        grid_size=8, max_steps=60, clutter_density=0.2, n_bonus_tiles=2, seed=seed,
+    )
+
+def make_cluttered(seed, observation_style):
+    return ClutteredMultiGrid(
+        agents=[GridAgentInterface(color=c, view_size=5, view_tile_size=4, observation_style=observation_style) for c in ['red', 'blue']],
+        grid_size=9, n_clutter=12, ghost_mode=False, max_steps=50, seed=seed,
+    )
+
+def make_doorkey(seed, observation_style):
+    return DoorKeyEnv(
+        agents=[GridAgentInterface(color=c, view_size=5, view_tile_size=4, observation_style=observation_style) for c in ['red', 'blue']],
+        grid_size=7, max_steps=100, seed=seed,
+    )
+
+
+class RecordingRNG:
+    '''
+    Wraps an env's np_random and keeps the last order MultiGridEnv.step shuffled the agents
+        into, so that the vectorized env can be made to use the same one.
+    '''
+    def __init__(self, rng):
+        self.rng = rng
+        self.order = None
+
+    def __getattr__(self, name):
+        return getattr(self.rng, name)
+
+    def shuffle(self, x):
+        self.rng.shuffle(x)
+        self.order = np.array(x)
+
+
+@pytest.mark.parametrize('observation_style', ['image', 'symbolic', 'palette'])
+@pytest.mark.parametrize('make_env', [make_goalcycle, make_cluttered, make_doorkey])
+def test_vec_env_matches_single_envs(make_env, observation_style):
+    for seed in range(2):
+        env = make_env(seed, observation_style)
+        vec = VecMultiGridEnv([make_env(seed, observation_style)], auto_reset=False)
+        np.testing.assert_array_equal(vec.reset()[0], np.stack(env.reset()))
+
+        rng = np.random.default_rng(seed)
+        env.np_random = recorder = RecordingRNG(env.np_random)
+        vec._shuffled_order = lambda: recorder.order[None]
+        done = False
+        while not done:
+            actions = rng.choice(7, size=len(env.agents), p=[.2, .2, .3, .1, .1, .1, 0])
+            obs, rewards, done, _ = env.step(actions)
+            vec_obs, vec_rewards, vec_done, _ = vec.step(actions[None])
+            np.testing.assert_array_equal(vec_obs[0], np.stack(obs))
+            np.testing.assert_allclose(vec_rewards[0], rewards)
+            assert vec_done[0] == done
@@ -0,0 +1,161 @@
+import pickle
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from marlgrid.envs import ClutteredGoalCycleEnv, DoorKeyEnv
+from marlgrid.agents import GridAgentInterface
+from marlgrid.utils.video import ApngWriter, EpisodeLog, NpyWriter, export_episode, open_video_writer
+
+
+def make_goalcycle():
+    return ClutteredGoalCycleEnv(
+        agents=[GridAgentInterface(color='prestige', view_size=5, view_tile_size=4, spawn_delay=2*k) for k in range(3)],
+        grid_size=9, clutter_density=0.15, n_bonus_tiles=3, respawn=True, max_steps=60, seed=4,
+    )
+
+def make_doorkey():
+    return DoorKeyEnv(
+        agents=[GridAgentInterface(color=c, view_size=5, view_tile_size=4) for c in ['red', 'blue']],
+        grid_size=7, max_steps=60, seed=2,
+    )
+
+
+def make_frames(n=11, height=5, width=7, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(n, height, width, 3), dtype=np.uint8)
+
+
+def upscale(frames, s):
+    return frames.repeat(s, axis=1).repeat(s, axis=2)
+
+
+def read_apng(path):
+    # Just enough of a decoder for what ApngWriter writes: unfiltered RGB8, one IDAT/fdAT per frame.
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    pos, chunks = 8, []
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos+8])
+        body = data[pos+8:pos+8+length]
+        assert struct.unpack(">I", data[pos+8+length:pos+12+length])[0] == zlib.crc32(kind + body)
+        chunks.append((kind, body))
+        pos += 12 + length
+    assert chunks[0][0] == b"IHDR" and chunks[-1][0] == b"IEND"
+    width, height = struct.unpack(">II", chunks[0][1][:8])
+    n_frames = struct.unpack(">II", dict(chunks)[b"acTL"])[0]
+    frames, delays, sequence = [], [], []
+    for kind, body in chunks:
+        if kind == b"fcTL":
+            sequence.append(struct.unpack(">I", body[:4])[0])
+            delays.append(struct.unpack(">HH", body[20:24]))
+        elif kind in (b"IDAT", b"fdAT"):
+            if kind == b"fdAT":
+                sequence.append(struct.unpack(">I", body[:4])[0])
+                body = body[4:]
+            rows = np.frombuffer(zlib.decompress(body), dtype=np.uint8).reshape(height, 1 + width*3)
+            assert not rows[:, 0].any()
+            frames.append(rows[:, 1:].reshape(height, width, 3))
+    assert sequence == list(range(len(sequence)))
+    assert n_frames == len(frames)
+    return np.stack(frames), delays
+
+
+@pytest.mark.parametrize('rescale_factor', [1, 3])
+@pytest.mark.parametrize('chunk_size', [4, 32])
+def test_npy_writer_round_trip(tmp_path, rescale_factor, chunk_size):
+    frames = make_frames()
+    path = str(tmp_path / "frames.npy")
+    with open_video_writer(path, rescale_factor=rescale_factor, chunk_size=chunk_size) as writer:
+        assert isinstance(writer, NpyWriter)
+        for frame in frames:
+            writer.append(frame)
+    assert writer.n_frames == len(frames)
+    np.testing.assert_array_equal(np.load(path), upscale(frames, rescale_factor))
+    np.testing.assert_array_equal(np.load(path, mmap_mode='r'), upscale(frames, rescale_factor))
+
+
+def test_npy_writer_scales_float_frames(tmp_path):
+    frames = make_frames(n=3)
+    path = str(tmp_path / "frames.npy")
+    with NpyWriter(path) as writer:
+        for frame in frames:
+            writer.append(frame / 255)
+    assert np.abs(np.load(path).astype(int) - frames).max() <= 1
+
+
+@pytest.mark.parametrize('rescale_factor', [1, 2])
+@pytest.mark.parametrize('chunk_size', [4, 32])
+def test_apng_writer_round_trip(tmp_path, rescale_factor, chunk_size):
+    frames = make_frames()
+    path = str(tmp_path / "frames.png")
+    with open_video_writer(path, fps=20, rescale_factor=rescale_factor, chunk_size=chunk_size) as writer:
+        assert isinstance(writer, ApngWriter)
+        for frame in frames:
+            writer.append(frame)
+    decoded, delays = read_apng(path)
+    np.testing.assert_array_equal(decoded, upscale(frames, rescale_factor))
+    assert set(delays) == {(1, 20)}
+
+
+def test_apng_writer_reads_back_with_pil(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    ImageSequence = pytest.importorskip("PIL.ImageSequence")
+    frames = make_frames()
+    path = str(tmp_path / "frames.apng")
+    with ApngWriter(path, fps=20, chunk_size=4) as writer:
+        for frame in frames:
+            writer.append(frame)
+    with Image.open(path) as im:
+        assert im.n_frames == len(frames)
+        decoded = np.stack([np.asarray(frame.convert("RGB")) for frame in ImageSequence.Iterator(im)])
+    np.testing.assert_array_equal(decoded, frames)
+
+
+def test_writers_reject_frames_of_another_shape(tmp_path):
+    with NpyWriter(str(tmp_path / "frames.npy")) as writer:
+        writer.append(make_frames(n=1)[0])
+        with pytest.raises(ValueError, match="doesn't match the previous frames"):
+            writer.append(make_frames(n=1, width=6)[0])
+
+
+def record_episode(env, seed):
+    rng = np.random.default_rng(seed)
+    env.reset()
+    log = EpisodeLog(env)
+    live = []
+    done = False
+    t = 0
+    while not done:
+        log.record(env)
+        live.append(env.render(mode='rgb_array'))
+        # Mostly moves, with enough pickups/drops/toggles to change objects.
+        actions = rng.integers(0, 7 if rng.random() < .4 else 3, size=len(env.agents))
+        if t == 7:
+            env.agents[0].color = 'green'
+        _, _, done, _ = env.step(actions)
+        t += 1
+    log.record(env)
+    live.append(env.render(mode='rgb_array'))
+    return log, live
+
+
+@pytest.mark.parametrize('make_env', [make_goalcycle, make_doorkey])
+def test_episode_log_replay_matches_render(make_env):
+    env = make_env()
+    for seed in range(2):
+        log, live = record_episode(env, seed)
+        for replayed in [log, pickle.loads(pickle.dumps(log))]:
+            frames = list(replayed.render())
+            assert len(frames) == len(live)
+            for frame, expected in zip(frames, live):
+                np.testing.assert_array_equal(frame, expected)
+
+
+def test_export_saved_episode(tmp_path):
+    log, live = record_episode(make_doorkey(), 0)
+    log.save(str(tmp_path / "states.pkl"))
+    outfile = export_episode(str(tmp_path / "states.pkl"), str(tmp_path / "episode.npy"))
+    np.testing.assert_array_equal(np.load(outfile), np.stack(live))